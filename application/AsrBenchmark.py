@@ -0,0 +1,238 @@
+"""
+This file is responsible for evaluating the speech recognition offline, on recorded utterances instead of a microphone.
+Every utterance of a labels file is a WAV file with the text that was said and the position it was said in.
+The files are run through KaldiRecognizer and NotationTranslator, with and without the grammar of the valid moves,
+and the word and move accuracy, the real-time factor and the time of every stage are reported.
+
+The labels file has a line "file.wav<TAB>spoken text<TAB>FEN<TAB>expected move" per utterance, the move in the
+notation of NotationTranslator.moveNotation ("Ng1-f3"). The FEN may be left empty for the start position and the paths
+are relative to the labels file. --record makes such a corpus from the microphone.
+
+Usage: python AsrBenchmark.py LABELS [--model PATH] [--grammar none|moves|both] [--verbose]
+       python AsrBenchmark.py LABELS --record N [--seconds S]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+import wave
+
+from vosk import Model, KaldiRecognizer, SetLogLevel
+from translator import NotationTranslator
+
+import ChessEngine
+
+MODEL_PATH = "./data/vosk-model-small-ru-0.22"
+SAMPLE_RATE = 16000  # of the recorded files
+CHUNK_FRAMES = 4000  # fed to the recognizer at a time, the same as the live recognition
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+
+class Utterance:
+    def __init__(self, path, text, fen=START_FEN, move=None):
+        self.path = path
+        self.text = text  # what was said
+        self.fen = fen  # the position it was said in
+        self.move = move  # the notation of the move meant, None in the old labels files without it
+
+
+def readLabels(labelsPath):
+    """
+    Reads the utterances of a labels file. The files of three columns, without the expected moves, are still read;
+    their moves are taken from the text by the translator under test, so a translator error isn't noticed.
+    """
+    utterances = []
+    directory = os.path.dirname(labelsPath)
+    with open(labelsPath, encoding="utf-8") as file:
+        for line in file:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) < 2:
+                raise ValueError("Expected \"file<TAB>text[<TAB>FEN<TAB>move]\": " + line)
+            fen = fields[2] if len(fields) > 2 and fields[2] else START_FEN
+            move = fields[3].strip() if len(fields) > 3 and fields[3].strip() else None
+            utterances.append(Utterance(os.path.join(directory, fields[0]), fields[1].strip().lower(), fen, move))
+    unlabelled = sum(utterance.move is None for utterance in utterances)
+    if unlabelled:
+        print("Warning: %d of %d utterances have no expected move, it is taken from their text by the translator"
+              % (unlabelled, len(utterances)))
+    return utterances
+
+
+def readWav(path):
+    """
+    Returns (frame rate, 16-bit mono audio) of a WAV file.
+    """
+    with wave.open(path, "rb") as file:
+        if file.getnchannels() != 1 or file.getsampwidth() != 2:
+            raise ValueError(path + ": 16-bit mono audio expected")
+        return file.getframerate(), file.readframes(file.getnframes())
+
+
+def recognize(model, frameRate, frames, grammar=None):
+    """
+    Runs the audio through a new recognizer the way the live recognition does, chunk by chunk.
+    Returns the text and the times of the stages: setup (the recognizer and its grammar), decode (feeding the
+    audio) and final (getting the result after the last chunk).
+    """
+    start = time.perf_counter()
+    if grammar is None:
+        recognizer = KaldiRecognizer(model, frameRate)
+    else:
+        recognizer = KaldiRecognizer(model, frameRate, json.dumps(grammar, ensure_ascii=False))
+    setupTime = time.perf_counter() - start
+    texts = []
+    start = time.perf_counter()
+    chunkBytes = CHUNK_FRAMES * 2
+    for i in range(0, len(frames), chunkBytes):
+        if recognizer.AcceptWaveform(frames[i:i + chunkBytes]):
+            texts.append(json.loads(recognizer.Result()).get("text", ""))
+    decodeTime = time.perf_counter() - start
+    start = time.perf_counter()
+    texts.append(json.loads(recognizer.FinalResult()).get("text", ""))
+    finalTime = time.perf_counter() - start
+    return " ".join(text for text in texts if text), {"setup": setupTime, "decode": decodeTime, "final": finalTime}
+
+
+class BenchmarkStats:
+    def __init__(self, name):
+        self.name = name
+        self.utterances = 0
+        self.referenceWords = 0
+        self.wordErrors = 0
+        self.exactMoves = 0  # translated to the expected move by reformatSpeech
+        self.resolvedMoves = 0  # resolved to the expected move by resolveMove
+        self.audioSeconds = 0
+        self.stageTimes = {"setup": [], "decode": [], "final": [], "translate": [], "resolve": []}
+
+    def addTimes(self, times):
+        for stage, seconds in times.items():
+            self.stageTimes[stage].append(seconds)
+
+    def getReport(self):
+        decodeTime = sum(self.stageTimes["decode"]) + sum(self.stageTimes["final"])
+        lines = ["%s: %d utterances, %.1f s of audio" % (self.name, self.utterances, self.audioSeconds),
+                 "  word error rate %.1f%%, moves translated %.1f%%, moves resolved %.1f%%, real-time factor %.3f"
+                 % (100 * self.wordErrors / max(1, self.referenceWords),
+                    100 * self.exactMoves / max(1, self.utterances), 100 * self.resolvedMoves / max(1, self.utterances),
+                    decodeTime / self.audioSeconds if self.audioSeconds > 0 else 0)]
+        for stage, times in self.stageTimes.items():
+            if times:
+                lines.append("  %-9s median %8.2f ms, max %8.2f ms" % (stage, statistics.median(times) * 1000,
+                                                                        max(times) * 1000))
+        return "\n".join(lines)
+
+
+def evaluate(model, utterances, useGrammar, translator, verbose=False):
+    """
+    Recognizes every utterance and compares the text and the move with the labels.
+    An utterance without an expected move expects the valid move its text names.
+    """
+    stats = BenchmarkStats("grammar of the valid moves" if useGrammar else "no grammar")
+    for utterance in utterances:
+        gs = ChessEngine.GameState.fromFen(utterance.fen)
+        validMoves = gs.getValidMoves()
+        expected = utterance.move
+        if expected is None:
+            expectedMove, _ = translator.resolveMove(utterance.text, validMoves)
+            expected = translator.moveNotation(expectedMove) if expectedMove is not None else \
+                translator.reformatSpeech(utterance.text)
+        frameRate, frames = readWav(utterance.path)
+        text, times = recognize(model, frameRate, frames, translator.buildGrammar(validMoves) if useGrammar else None)
+
+        start = time.perf_counter()
+        spokenMove = translator.translate(text)
+        times["translate"] = time.perf_counter() - start
+        start = time.perf_counter()
+        move, _ = translator.resolveMove(text, validMoves)
+        times["resolve"] = time.perf_counter() - start
+
+        stats.utterances += 1
+        stats.audioSeconds += len(frames) / 2 / frameRate
+        referenceWords = utterance.text.split()
+        stats.referenceWords += len(referenceWords)
+        stats.wordErrors += NotationTranslator.editDistance(referenceWords, text.split())
+        stats.exactMoves += spokenMove.isComplete() and spokenMove.getNotation() == expected
+        resolved = move is not None and translator.moveNotation(move) == expected
+        stats.resolvedMoves += resolved
+        stats.addTimes(times)
+        if verbose:
+            print("%s: \"%s\" -> \"%s\" %s" % (os.path.basename(utterance.path), utterance.text, text,
+                                                "ok" if resolved else "expected " + expected))
+    return stats
+
+
+def record(labelsPath, count, seconds, seed=None):
+    """
+    Records count utterances from the microphone: a random valid move of a random game is shown, said and
+    added to the labels file.
+    """
+    import pyaudio  # only needed for recording
+
+    random.seed(seed)
+    translator = NotationTranslator.NotationTranslator()
+    directory = os.path.dirname(labelsPath)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    audioManager = pyaudio.PyAudio()
+    stream = audioManager.open(format=pyaudio.paInt16, channels=1, rate=SAMPLE_RATE, input=True,
+                               frames_per_buffer=CHUNK_FRAMES)
+    gs = ChessEngine.GameState()
+    try:
+        with open(labelsPath, "a", encoding="utf-8") as labels:
+            for i in range(count):
+                validMoves = gs.getValidMoves()
+                if not validMoves:
+                    gs = ChessEngine.GameState()
+                    validMoves = gs.getValidMoves()
+                move = random.choice(validMoves)
+                phrase = translator.movePhrase(move)
+                input("%d/%d. Press Enter and say: %s" % (i + 1, count, phrase))
+                stream.start_stream()
+                frames = b"".join(stream.read(CHUNK_FRAMES, exception_on_overflow=False)
+                                  for _ in range(int(seconds * SAMPLE_RATE / CHUNK_FRAMES)))
+                stream.stop_stream()
+                fileName = time.strftime("%Y%m%d-%H%M%S") + "-%03d.wav" % i
+                with wave.open(os.path.join(directory, fileName), "wb") as file:
+                    file.setnchannels(1)
+                    file.setsampwidth(2)
+                    file.setframerate(SAMPLE_RATE)
+                    file.writeframes(frames)
+                labels.write(fileName + "\t" + phrase + "\t" + gs.toFen() + "\t" + translator.moveNotation(move) + "\n")
+                labels.flush()
+                gs.makeMove(move)
+    finally:
+        stream.close()
+        audioManager.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline evaluation of the speech recognition")
+    parser.add_argument("labels", help="labels file: \"file.wav<TAB>spoken text<TAB>FEN<TAB>move\" per line")
+    parser.add_argument("--model", default=MODEL_PATH, help="path of the Vosk model")
+    parser.add_argument("--grammar", choices=("none", "moves", "both"), default="both",
+                        help="recognize without a grammar, with the grammar of the valid moves or both")
+    parser.add_argument("--verbose", action="store_true", help="print every utterance")
+    parser.add_argument("--record", type=int, metavar="N", help="record N utterances into the labels file")
+    parser.add_argument("--seconds", type=float, default=3.0, help="length of a recorded utterance")
+    args = parser.parse_args()
+    if args.record is not None:
+        record(args.labels, args.record, args.seconds)
+        return
+
+    utterances = readLabels(args.labels)
+    SetLogLevel(-1)
+    start = time.perf_counter()
+    model = Model(args.model)
+    print("Model loaded in %.2f s" % (time.perf_counter() - start))
+    translator = NotationTranslator.NotationTranslator()
+    for useGrammar in {"none": [False], "moves": [True], "both": [False, True]}[args.grammar]:
+        print(evaluate(model, utterances, useGrammar, translator, args.verbose).getReport())
+
+
+if __name__ == "__main__":
+    main()
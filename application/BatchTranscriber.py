@@ -0,0 +1,183 @@
+"""
+This file is responsible for transcribing recorded audio offline and in parallel.
+WAV files, or long recordings cut at their quietest moments into segments, are recognized by a process pool,
+every worker loads the Vosk model once. Every recognized utterance is written as a JSON line as soon as its file
+or segment is done, in the order of the input, with its time in the recording, its text and the move translated
+from it.
+
+Usage: python BatchTranscriber.py FILE_OR_DIRECTORY [...] [--output FILE] [--workers N] [--segment SECONDS]
+       [--model PATH]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import wave
+from array import array
+
+from vosk import Model, KaldiRecognizer, SetLogLevel
+from translator import NotationTranslator
+
+import AsrBenchmark
+
+FRAME_SECONDS = 0.1  # the loudness is measured over frames this long
+CUT_WINDOW_SECONDS = 5.0  # a long recording is cut at the quietest frame of this window after every segment
+
+workerModel = None  # the model and the translator of a worker process, see initWorker
+workerTranslator = None
+
+
+def findWavFiles(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, fileNames in sorted(os.walk(path)):
+                for fileName in sorted(fileNames):
+                    if fileName.lower().endswith(".wav"):
+                        yield os.path.join(directory, fileName)
+        else:
+            yield path
+
+
+def getFrameLoudness(file, frameLength):
+    """
+    Mean absolute amplitude of every frame of a 16-bit mono WAV file.
+    """
+    loudness = []
+    file.rewind()
+    while True:
+        data = file.readframes(frameLength)
+        if not data:
+            return loudness
+        samples = array("h", data)
+        loudness.append(sum(abs(sample) for sample in samples) / len(samples))
+
+
+def findSegments(path, segmentSeconds):
+    """
+    Returns (start frame, end frame) of the segments of a recording. Every segment is at least segmentSeconds long
+    and is cut at the quietest moment of the next CUT_WINDOW_SECONDS, so a word is rarely cut in two.
+    """
+    with wave.open(path, "rb") as file:
+        frameRate = file.getframerate()
+        totalFrames = file.getnframes()
+        if segmentSeconds <= 0 or totalFrames <= (segmentSeconds + CUT_WINDOW_SECONDS) * frameRate:
+            return [(0, totalFrames)]
+        if file.getnchannels() != 1 or file.getsampwidth() != 2:
+            return [(0, totalFrames)]  # the worker reports the format
+        frameLength = int(FRAME_SECONDS * frameRate)
+        loudness = getFrameLoudness(file, frameLength)
+    segmentFrames = int(segmentSeconds / FRAME_SECONDS)
+    windowFrames = int(CUT_WINDOW_SECONDS / FRAME_SECONDS)
+    boundaries = [0]
+    start = 0
+    while len(loudness) - start > segmentFrames + windowFrames:
+        window = range(start + segmentFrames, start + segmentFrames + windowFrames)
+        start = min(window, key=loudness.__getitem__)
+        boundaries.append(start * frameLength + frameLength // 2)  # the middle of the quietest frame
+    boundaries.append(totalFrames)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def initWorker(modelPath):
+    global workerModel, workerTranslator
+    SetLogLevel(-1)
+    workerModel = Model(modelPath)
+    workerTranslator = NotationTranslator.NotationTranslator()
+
+
+def transcribeSegment(job):
+    """
+    Recognizes a segment of a file. Returns the utterances as dicts for the JSON lines and the seconds of audio.
+    """
+    path, startFrame, endFrame = job
+    try:
+        with wave.open(path, "rb") as file:
+            if file.getnchannels() != 1 or file.getsampwidth() != 2:
+                raise ValueError("16-bit mono audio expected")
+            frameRate = file.getframerate()
+            file.setpos(startFrame)
+            recognizer = KaldiRecognizer(workerModel, frameRate)
+            recognizer.SetWords(True)
+            results = []
+            position = startFrame
+            while position < endFrame:
+                data = file.readframes(min(AsrBenchmark.CHUNK_FRAMES, endFrame - position))
+                if not data:
+                    break
+                position += len(data) // 2
+                if recognizer.AcceptWaveform(data):
+                    results.append(json.loads(recognizer.Result()))
+            results.append(json.loads(recognizer.FinalResult()))
+    except (OSError, EOFError, ValueError, wave.Error) as e:
+        return [{"file": path, "error": str(e) or e.__class__.__name__}], 0
+
+    offset = startFrame / frameRate
+    utterances = []
+    for result in results:
+        text = result.get("text", "")
+        if not text:
+            continue
+        words = result.get("result", [])
+        spokenMove = workerTranslator.translate(text)
+        utterances.append({"file": path,
+                           "start": round(offset + words[0]["start"], 2) if words else None,
+                           "end": round(offset + words[-1]["end"], 2) if words else None,
+                           "text": text,
+                           "move": spokenMove.getNotation() if spokenMove.isComplete() else None,
+                           "score": round(spokenMove.getScore(), 2)})
+    return utterances, (endFrame - startFrame) / frameRate
+
+
+def iterateJobs(paths, segmentSeconds):
+    for path in findWavFiles(paths):
+        try:
+            segments = findSegments(path, segmentSeconds)
+        except (OSError, EOFError, wave.Error):
+            segments = [(0, 0)]  # the worker reports the error
+        for startFrame, endFrame in segments:
+            yield path, startFrame, endFrame
+
+
+def transcribeFiles(paths, output, modelPath=AsrBenchmark.MODEL_PATH, workers=1, segmentSeconds=30):
+    """
+    Writes a JSON line for every utterance of the files to output and returns (utterances, seconds of audio).
+    The results come in the order of the files and the segments; a worker loads the model once for all its jobs.
+    """
+    utterances = 0
+    audioSeconds = 0
+    with multiprocessing.Pool(workers, initializer=initWorker, initargs=(modelPath,)) as pool:
+        for lines, seconds in pool.imap(transcribeSegment, iterateJobs(paths, segmentSeconds)):
+            for line in lines:
+                output.write(json.dumps(line, ensure_ascii=False) + "\n")
+            output.flush()
+            utterances += sum("text" in line for line in lines)
+            audioSeconds += seconds
+    return utterances, audioSeconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel offline transcription of WAV files into JSON lines")
+    parser.add_argument("paths", nargs="+", help="WAV files or directories with them")
+    parser.add_argument("--output", help="JSON lines file, the standard output if not given")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--segment", type=float, default=30.0,
+                        help="long recordings are cut into segments of about this many seconds, 0 not to cut")
+    parser.add_argument("--model", default=AsrBenchmark.MODEL_PATH, help="path of the Vosk model")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        utterances, audioSeconds = transcribeFiles(args.paths, output, args.model, args.workers, args.segment)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+    print("%d utterances from %.1f s of audio in %.1f s, %.1f times faster than real time"
+          % (utterances, audioSeconds, elapsed, audioSeconds / elapsed if elapsed > 0 else 0), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+This file is responsible for the bitboard representation of the board and for generating legal moves from it.
+Square index is row * 8 + col, so index 0 is a8 and index 63 is h1 (the same orientation as GameState.board).
+"""
+
+PIECES = ["wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+WHITE, BLACK = 0, 6  # offsets of the sides in the piece list
+
+NORMAL = 0
+EN_PASSANT = 1
+CASTLE = 2
+PROMOTION = 3  # a pawn move to the last rank, stands for one move per promoting piece
+
+FULL = (1 << 64) - 1
+
+ORTHOGONAL_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+DIAGONAL_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+DIRECTIONS = ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS
+
+
+def _leaperAttacks(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        attacks = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
+                attacks |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(attacks)
+    return table
+
+
+def _rays(d):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        ray = 0
+        for i in range(1, 8):
+            if 0 <= r + d[0] * i <= 7 and 0 <= c + d[1] * i <= 7:
+                ray |= 1 << ((r + d[0] * i) * 8 + c + d[1] * i)
+            else:
+                break
+        table.append(ray)
+    return table
+
+
+KNIGHT_ATTACKS = _leaperAttacks(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = _leaperAttacks(((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)))
+PAWN_ATTACKS = {WHITE: _leaperAttacks(((-1, -1), (-1, 1))), BLACK: _leaperAttacks(((1, -1), (1, 1)))}
+RAYS = {d: _rays(d) for d in DIRECTIONS}
+# rays going towards higher indexes meet their nearest blocker at the lowest bit, the others at the highest bit
+POSITIVE = {d: d[0] * 8 + d[1] > 0 for d in DIRECTIONS}
+
+
+def _between():
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for d in DIRECTIONS:
+            ray = RAYS[d][sq]
+            while ray:
+                target = _nearest(d, ray)
+                table[sq][target] = RAYS[d][sq] & ~RAYS[d][target] & ~(1 << target)
+                ray ^= 1 << target
+    return table
+
+
+def _nearest(d, bits):
+    if POSITIVE[d]:
+        return (bits & -bits).bit_length() - 1
+    return bits.bit_length() - 1
+
+
+BETWEEN = _between()  # squares strictly between two aligned squares, 0 if not aligned
+# per square: (ray, ray table of its direction, positive) for every non-empty ray
+ORTHOGONAL_RAYS = [tuple((RAYS[d][sq], RAYS[d], POSITIVE[d]) for d in ORTHOGONAL_DIRECTIONS if RAYS[d][sq])
+                   for sq in range(64)]
+DIAGONAL_RAYS = [tuple((RAYS[d][sq], RAYS[d], POSITIVE[d]) for d in DIAGONAL_DIRECTIONS if RAYS[d][sq])
+                 for sq in range(64)]
+SQUARES = [divmod(sq, 8) for sq in range(64)]  # square index -> (row, col)
+
+
+def slidingAttacks(occupied, rays):
+    attacks = 0
+    for ray, table, positive in rays:
+        blockers = ray & occupied
+        if blockers:
+            # cut everything behind the first blocker
+            ray ^= table[(blockers & -blockers).bit_length() - 1 if positive else blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+def rookAttacks(sq, occupied):
+    return slidingAttacks(occupied, ORTHOGONAL_RAYS[sq])
+
+
+def bishopAttacks(sq, occupied):
+    return slidingAttacks(occupied, DIAGONAL_RAYS[sq])
+
+
+def squares(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class Bitboards:
+    def __init__(self, board):
+        """
+
+        Twelve piece sets (in the order of PIECES) plus the occupancy of every side.
+        mailbox keeps the piece index of every square (-1 for an empty one), so the sets can be updated
+        incrementally from the squares a move has touched.
+
+        """
+        self.pieces = [0] * 12
+        self.mailbox = [-1] * 64
+        self.white = 0
+        self.black = 0
+        self.occupied = 0
+        self.refreshSquares(board, [(r, c) for r in range(8) for c in range(8)])
+
+    def refreshSquares(self, board, changedSquares):
+        for r, c in changedSquares:
+            sq = r * 8 + c
+            new = PIECE_INDEX.get(board[r][c], -1)
+            old = self.mailbox[sq]
+            if old == new:
+                continue
+            bit = 1 << sq
+            if old >= 0:
+                self.pieces[old] ^= bit
+            if new >= 0:
+                self.pieces[new] |= bit
+            self.mailbox[sq] = new
+        p = self.pieces
+        self.white = p[0] | p[1] | p[2] | p[3] | p[4] | p[5]
+        self.black = p[6] | p[7] | p[8] | p[9] | p[10] | p[11]
+        self.occupied = self.white | self.black
+
+    def attackersTo(self, sq, occupied, byWhite):
+        p = self.pieces
+        side = WHITE if byWhite else BLACK
+        # a square is attacked by a white pawn from where a black pawn on it would attack, and vice versa
+        attackers = PAWN_ATTACKS[BLACK if byWhite else WHITE][sq] & p[side + PAWN]
+        attackers |= KNIGHT_ATTACKS[sq] & p[side + KNIGHT]
+        attackers |= KING_ATTACKS[sq] & p[side + KING]
+        attackers |= bishopAttacks(sq, occupied) & (p[side + BISHOP] | p[side + QUEEN])
+        attackers |= rookAttacks(sq, occupied) & (p[side + ROOK] | p[side + QUEEN])
+        return attackers
+
+    def isAttacked(self, sq, occupied, byWhite):
+        p = self.pieces
+        side = WHITE if byWhite else BLACK
+        if PAWN_ATTACKS[BLACK if byWhite else WHITE][sq] & p[side + PAWN] or \
+                KNIGHT_ATTACKS[sq] & p[side + KNIGHT] or KING_ATTACKS[sq] & p[side + KING]:
+            return True
+        diagonal = p[side + BISHOP] | p[side + QUEEN]
+        if diagonal and bishopAttacks(sq, occupied) & diagonal:
+            return True
+        orthogonal = p[side + ROOK] | p[side + QUEEN]
+        return bool(orthogonal and rookAttacks(sq, occupied) & orthogonal)
+
+    def generateLegalMoves(self, whiteToMove, enPassantSquare, castlingRights):
+        """
+        Returns the list of legal moves as (startSquare, endSquare, flag) tuples and the bitboard of checkers.
+        enPassantSquare is -1 if there is none, castlingRights is a (wks, bks, wqs, bqs) tuple.
+        """
+        p = self.pieces
+        us, them = (WHITE, BLACK) if whiteToMove else (BLACK, WHITE)
+        own, enemy = (self.white, self.black) if whiteToMove else (self.black, self.white)
+        occupied = self.occupied
+        moves = []
+
+        kingBit = p[us + KING]
+        kingSq = kingBit.bit_length() - 1
+        checkers = self.attackersTo(kingSq, occupied, not whiteToMove)
+
+        # king moves, with the king lifted from the board so that it doesn't shield the squares behind itself
+        occupiedWithoutKing = occupied ^ kingBit
+        for to in squares(KING_ATTACKS[kingSq] & ~own):
+            if not self.isAttacked(to, occupiedWithoutKing, not whiteToMove):
+                moves.append((kingSq, to, NORMAL))
+
+        if checkers & (checkers - 1):  # double check, only the king can move
+            return moves, checkers
+        if checkers:
+            checkerSq = checkers.bit_length() - 1
+            targetMask = checkers | BETWEEN[kingSq][checkerSq]
+        else:
+            targetMask = FULL
+
+        # pinned pieces and the lines they are allowed to move along
+        pinRays = {}
+        orthogonalSliders = p[them + ROOK] | p[them + QUEEN]
+        diagonalSliders = p[them + BISHOP] | p[them + QUEEN]
+        for d in DIRECTIONS:
+            sliders = orthogonalSliders if d in ORTHOGONAL_DIRECTIONS else diagonalSliders
+            if not sliders & RAYS[d][kingSq]:
+                continue
+            blockers = RAYS[d][kingSq] & occupied
+            if not blockers:
+                continue
+            first = _nearest(d, blockers)
+            if not own & (1 << first):
+                continue
+            blockers ^= 1 << first
+            if not blockers:
+                continue
+            second = _nearest(d, blockers)
+            if sliders & (1 << second):
+                pinRays[first] = BETWEEN[kingSq][second] | (1 << second)
+
+        notOwn = ~own & targetMask
+        for sq in squares(p[us + KNIGHT]):
+            if sq not in pinRays:
+                for to in squares(KNIGHT_ATTACKS[sq] & notOwn):
+                    moves.append((sq, to, NORMAL))
+        for sq in squares(p[us + BISHOP] | p[us + QUEEN]):
+            targets = bishopAttacks(sq, occupied) & notOwn
+            if sq in pinRays:
+                targets &= pinRays[sq]
+            for to in squares(targets):
+                moves.append((sq, to, NORMAL))
+        for sq in squares(p[us + ROOK] | p[us + QUEEN]):
+            targets = rookAttacks(sq, occupied) & notOwn
+            if sq in pinRays:
+                targets &= pinRays[sq]
+            for to in squares(targets):
+                moves.append((sq, to, NORMAL))
+
+        step, startRow, lastRow = (-8, 6, 0) if whiteToMove else (8, 1, 7)
+        for sq in squares(p[us + PAWN]):
+            allowed = targetMask & pinRays.get(sq, FULL)
+            flag = PROMOTION if (sq + step) // 8 == lastRow else NORMAL
+            to = sq + step
+            if not occupied & (1 << to):
+                if allowed & (1 << to):
+                    moves.append((sq, to, flag))
+                if sq // 8 == startRow and not occupied & (1 << (to + step)) and allowed & (1 << (to + step)):
+                    moves.append((sq, to + step, NORMAL))
+            for to in squares(PAWN_ATTACKS[us][sq] & enemy & allowed):
+                moves.append((sq, to, flag))
+            if enPassantSquare >= 0 and PAWN_ATTACKS[us][sq] & (1 << enPassantSquare):
+                # play the capture on the occupancy and look for any attack on the king, this covers pins,
+                # checks and the horizontal pin of both pawns at once
+                capturedSq = enPassantSquare - step
+                occupiedAfter = (occupied ^ (1 << sq) ^ (1 << capturedSq)) | (1 << enPassantSquare)
+                if not self.attackersTo(kingSq, occupiedAfter, not whiteToMove) & ~(1 << capturedSq):
+                    moves.append((sq, enPassantSquare, EN_PASSANT))
+
+        if not checkers:
+            wks, bks, wqs, bqs = castlingRights
+            kingSide, queenSide = (wks, wqs) if whiteToMove else (bks, bqs)
+            homeSq = 60 if whiteToMove else 4
+            if kingSq == homeSq:
+                if kingSide and p[us + ROOK] & (1 << (homeSq + 3)) and not occupied & (0b11 << (homeSq + 1)) and \
+                        not self.isAttacked(homeSq + 1, occupied, not whiteToMove) and \
+                        not self.isAttacked(homeSq + 2, occupied, not whiteToMove):
+                    moves.append((homeSq, homeSq + 2, CASTLE))
+                if queenSide and p[us + ROOK] & (1 << (homeSq - 4)) and not occupied & (0b111 << (homeSq - 3)) and \
+                        not self.isAttacked(homeSq - 1, occupied, not whiteToMove) and \
+                        not self.isAttacked(homeSq - 2, occupied, not whiteToMove):
+                    moves.append((homeSq, homeSq - 2, CASTLE))
+        return moves, checkers
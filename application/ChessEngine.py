@@ -2,7 +2,11 @@
 This file is responsible for storing all information of GameState, for validating moves at the current state.
 It will also keep a MOVE LOG.
 """
-import copy
+import random
+import re
+from collections import OrderedDict
+
+import Bitboards
 
 
 class GameStateConstants:
@@ -14,9 +18,97 @@ class GameStateConstants:
         self.none = ""
 
 
+class ZobristKeys:
+    def __init__(self, seed):
+        """
+        Random 64-bit keys for Zobrist hashing. The seed is fixed, so the keys are the same in every run and process.
+        """
+        generator = random.Random(seed)
+        self.pieces = {piece: [generator.getrandbits(64) for _ in range(64)]
+                       for piece in ["wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK"]}
+        self.castling = {"wks": generator.getrandbits(64), "bks": generator.getrandbits(64),
+                         "wqs": generator.getrandbits(64), "bqs": generator.getrandbits(64)}
+        self.enPassantCols = [generator.getrandbits(64) for _ in range(8)]
+        self.blackToMove = generator.getrandbits(64)
+
+
+ZOBRIST = ZobristKeys(2022)
+
+
+SAN_PATTERN = re.compile(r"^(?:(O-O(?:-O)?)|([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?)$")
+
+SAN_KNIGHT_MOVES = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+SAN_SLIDER_DIRECTIONS = {"R": ((-1, 0), (0, -1), (0, 1), (1, 0)),
+                         "B": ((-1, -1), (-1, 1), (1, -1), (1, 1)),
+                         "Q": ((-1, 0), (0, -1), (0, 1), (1, 0), (-1, -1), (-1, 1), (1, -1), (1, 1))}
+SAN_SUFFIXES = {"": "", "+": "+", "++": "+", "#": "#", "~": ""}  # moveLogChecks -> SAN check suffix
+
+FEN_TO_PIECES = {"P": "wp", "R": "wR", "N": "wN", "B": "wB", "Q": "wQ", "K": "wK",
+                 "p": "bp", "r": "bR", "n": "bN", "b": "bB", "q": "bQ", "k": "bK"}
+PIECES_TO_FEN = {v: k for k, v in FEN_TO_PIECES.items()}
+FEN_EMPTY_SQUARES = {str(n): ["--"] * n for n in range(1, 9)}
+
+
+def parseFen(fen):
+    """
+    Parses a FEN string into the arguments of GameState.setPosition:
+    board, whiteToMove, castling rights, en passant square, halfmove clock and fullmove number.
+    Raises ValueError on an incorrect FEN.
+    """
+    fields = fen.split()
+    if len(fields) < 4:
+        raise ValueError("Incorrect FEN: " + fen)
+    board = []
+    for fenRow in fields[0].split("/"):
+        row = []
+        for char in fenRow:
+            if char in FEN_TO_PIECES:
+                row.append(FEN_TO_PIECES[char])
+            elif char in FEN_EMPTY_SQUARES:
+                row += FEN_EMPTY_SQUARES[char]
+            else:
+                raise ValueError("Incorrect FEN piece '" + char + "': " + fen)
+        if len(row) != 8:
+            raise ValueError("Incorrect FEN row '" + fenRow + "': " + fen)
+        board.append(row)
+    if len(board) != 8:
+        raise ValueError("Incorrect FEN board: " + fen)
+    for king in ("wK", "bK"):
+        if sum(row.count(king) for row in board) != 1:
+            raise ValueError("Incorrect FEN, one king of each colour expected: " + fen)
+    if fields[1] not in ("w", "b"):
+        raise ValueError("Incorrect FEN side to move '" + fields[1] + "': " + fen)
+    whiteToMove = fields[1] == "w"
+    castling = fields[2]
+    if castling != "-" and not set(castling) <= set("KQkq"):
+        raise ValueError("Incorrect FEN castling rights '" + castling + "': " + fen)
+    for right in castling.replace("-", ""):
+        row = 7 if right.isupper() else 0
+        color = "w" if right.isupper() else "b"
+        if board[row][4] != color + "K" or board[row][7 if right in "Kk" else 0] != color + "R":
+            raise ValueError("Incorrect FEN castling right '" + right + "', the king or the rook has moved: " + fen)
+    castlingRights = CastleRights("K" in castling, "k" in castling, "Q" in castling, "q" in castling)
+    enPassant = fields[3]
+    if enPassant == "-":
+        enPassantPossible = ()
+    elif len(enPassant) == 2 and enPassant[0] in Move.filesToCols and enPassant[1] == ("6" if whiteToMove else "3"):
+        row, col = Move.ranksToRows[enPassant[1]], Move.filesToCols[enPassant[0]]
+        direction = 1 if whiteToMove else -1  # from the en passant square to the pawn that has just moved
+        if board[row + direction][col] != ("b" if whiteToMove else "w") + "p" or board[row][col] != "--" or \
+                board[row - direction][col] != "--":
+            raise ValueError("Incorrect FEN en passant square '" + enPassant + "', no pawn has just moved past it: "
+                             + fen)
+        enPassantPossible = (row, col)
+    else:
+        raise ValueError("Incorrect FEN en passant square '" + enPassant + "': " + fen)
+    halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+    fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+    return board, whiteToMove, castlingRights, enPassantPossible, halfmoveClock, fullmoveNumber
+
+
 # todo: guarding condition on methods
 class GameState:
-    def __init__(self):
+    def __init__(self, useBitboards=False, moveCacheSize=4096):
         """
 
         The board is a 8x8 2dim list, each element containing 2 characters.
@@ -32,9 +124,12 @@ class GameState:
         K - king
         p - pawn
 
+        If useBitboards is set, the board is mirrored into Bitboards and the legal moves are generated from there.
+        The legal moves of the last moveCacheSize positions are kept in a MoveCache by the Zobrist key (0 disables it).
+
         """
 
-        self.board = [
+        board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -50,39 +145,120 @@ class GameState:
             "N": self.getNightMoves, "Q": self.getQueenMoves, "K": self.getKingMoves
         }
 
-        self.whiteToMove = True
+        self.gameStateConstants = GameStateConstants()
+        self.useBitboards = useBitboards
+        self.recordShortNotation = True  # perft and the search switch it off, they don't need the notation
+        self.moveCache = MoveCache(moveCacheSize) if moveCacheSize > 0 else None
+        self.setPosition(board, True, CastleRights(True, True, True, True))
+
+    def setPosition(self, board, whiteToMove, castlingRights, enPassantPossible=(), halfmoveClock=0, fullmoveNumber=1):
+        """
+        Sets up an arbitrary position and starts the move log, the other logs and the Zobrist key history from it.
+        """
+        self.board = board
+        self.whiteToMove = whiteToMove
+        self.halfmoveClock = halfmoveClock  # half-moves since the last capture or pawn move
+        self.halfmoveClockLog = [halfmoveClock]
+        self.fullmoveNumber = fullmoveNumber
         self.moveLog = []
-        self.whiteKingLocation = (7, 4)
-        self.blackKingLocation = (0, 4)
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == "wK":
+                    self.whiteKingLocation = (r, c)
+                elif board[r][c] == "bK":
+                    self.blackKingLocation = (r, c)
         self.inCheck = False
         self.inDoubleCheck = False
         self.checkmate = False
         self.stalemate = False
         self.pins = []
         self.checks = []
-        self.enPassantPossible = ()
+        self.enPassantPossible = enPassantPossible
         self.enPassantLog = [self.enPassantPossible]
-        self.currentCastlingRights = CastleRights(True, True, True, True)
-        self.CastleRightsLog = [CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
-                                             self.currentCastlingRights.wqs, self.currentCastlingRights.bqs)]
+        self.currentCastlingRights = castlingRights
+        self.CastleRightsLog = [self.currentCastlingRights.copy()]
         self.moveLogChecks = []
-        self.gameStateConstants = GameStateConstants()
+        self.bitboards = Bitboards.Bitboards(self.board) if self.useBitboards else None
+        self.zobristKey = self.hashSquares([(r, c) for r in range(8) for c in range(8)]) ^ self.hashState()
+        self.zobristLog = [self.zobristKey]
+        self.repetitionCounts = {self.zobristKey: 1}
+
+    @classmethod
+    def fromFen(cls, fen, useBitboards=False, moveCacheSize=4096):
+        gs = cls(useBitboards, moveCacheSize)
+        gs.setPosition(*parseFen(fen))
+        return gs
+
+    def loadFen(self, fen):
+        """
+        Sets up the position of a FEN string on this GameState.
+        Cheaper than fromFen when many positions are loaded one after another, the move cache is kept.
+        """
+        self.setPosition(*parseFen(fen))
+
+    def toFen(self):
+        """
+        FEN string of the current position, the en passant square is written after every double pawn push.
+        """
+        rows = []
+        for row in self.board:
+            fenRow = ""
+            emptySquares = 0
+            for piece in row:
+                if piece == "--":
+                    emptySquares += 1
+                else:
+                    if emptySquares:
+                        fenRow += str(emptySquares)
+                        emptySquares = 0
+                    fenRow += PIECES_TO_FEN[piece]
+            rows.append(fenRow + (str(emptySquares) if emptySquares else ""))
+        cr = self.currentCastlingRights
+        castling = ("K" if cr.wks else "") + ("Q" if cr.wqs else "") + ("k" if cr.bks else "") + ("q" if cr.bqs else "")
+        enPassant = Move.colsToFiles[self.enPassantPossible[1]] + Move.rowsToRanks[self.enPassantPossible[0]] \
+            if self.enPassantPossible != () else "-"
+        return "/".join(rows) + (" w " if self.whiteToMove else " b ") + (castling if castling else "-") + " " + \
+            enPassant + " " + str(self.halfmoveClock) + " " + str(self.fullmoveNumber)
+
+    def getSnapshot(self):
+        """
+        Compact picklable description of the position, without the move log and the other logs:
+        the board as a 128-character string, side to move, castling rights and the en passant square.
+        """
+        cr = self.currentCastlingRights
+        return ("".join("".join(row) for row in self.board), self.whiteToMove, (cr.wks, cr.bks, cr.wqs, cr.bqs),
+                self.enPassantPossible)
+
+    @classmethod
+    def fromSnapshot(cls, snapshot, useBitboards=False, moveCacheSize=4096):
+        boardString, whiteToMove, castlingRights, enPassantPossible = snapshot
+        gs = cls(useBitboards, moveCacheSize)
+        board = [[boardString[16 * r + 2 * c:16 * r + 2 * c + 2] for c in range(8)] for r in range(8)]
+        gs.setPosition(board, whiteToMove, CastleRights(*castlingRights), enPassantPossible)
+        return gs
 
     def makeMove(self, move):
+        if self.recordShortNotation and move.shortNotation is None:
+            move.shortNotation = self.getShortNotation(move)  # needs the position before the move
+        changedSquares = self.getChangedSquares(move)
+        zobristKey = self.zobristKey ^ self.hashSquares(changedSquares) ^ self.hashState()  # take out the old state
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move)  # store the move in move log
         self.whiteToMove = not self.whiteToMove  # switch sides
+        self.halfmoveClock = 0 if move.pieceMoved[1] == "p" or move.pieceCaptured != "--" else self.halfmoveClock + 1
+        self.halfmoveClockLog.append(self.halfmoveClock)
+        if self.whiteToMove:
+            self.fullmoveNumber += 1
         if move.pieceMoved == "wK":
             self.whiteKingLocation = (move.endRow, move.endCol)
         if move.pieceMoved == "bK":
             self.blackKingLocation = (move.endRow, move.endCol)
 
         if move.isPawnPromotion:
-            if move.piecePromoting != "--":
-                self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.piecePromoting
-            else:
-                self.board[move.endRow][move.endCol] = move.piecePromoting
+            # a pawn without the promoting piece specified becomes a queen
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + \
+                (move.piecePromoting if move.piecePromoting != "--" else "Q")
 
         if move.isEnPassantMove:
             if move.pieceMoved == "wp":
@@ -107,17 +283,24 @@ class GameState:
                 # grab the rook and move it
                 self.board[move.endRow][move.endCol - 2] = "--"  # erase the rook square
 
+        if self.bitboards is not None:
+            self.bitboards.refreshSquares(self.board, changedSquares)
+
         # update en-passant rights
         self.enPassantLog.append(self.enPassantPossible)
 
         # update castle rights if it's a rook or a king move
         self.updateCastleRights(move)
-        self.CastleRightsLog.append(CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
-                                                 self.currentCastlingRights.wqs, self.currentCastlingRights.bqs))
+        self.CastleRightsLog.append(self.currentCastlingRights.copy())
+
+        # put in the new state
+        self.zobristKey = zobristKey ^ self.hashSquares(changedSquares) ^ self.hashState()
+        self.zobristLog.append(self.zobristKey)
+        self.repetitionCounts[self.zobristKey] = self.repetitionCounts.get(self.zobristKey, 0) + 1
 
         # store the state (check, double check, checkmate, stalemate)
-        inCheck, _, _, inDoubleCheck = self.checkForPinsAndChecks()
         _ = self.getValidMoves()
+        inCheck, inDoubleCheck = self.inCheck, self.inDoubleCheck
 
         if self.checkmate:
             self.moveLogChecks.append(self.gameStateConstants.checkmate)
@@ -154,7 +337,7 @@ class GameState:
             self.enPassantPossible = self.enPassantLog[-1]
 
             self.CastleRightsLog.pop()
-            self.currentCastlingRights = self.CastleRightsLog[-1]
+            self.currentCastlingRights = self.CastleRightsLog[-1].copy()  # the log entry must not be changed later
 
             if move.isCastleMove:
                 if move.endCol - move.startCol == 2:  # kingside castle
@@ -163,8 +346,61 @@ class GameState:
                 else:  # queenside castle
                     self.board[move.endRow][move.endCol - 2] = self.board[move.endRow][move.endCol + 1]
                     self.board[move.endRow][move.endCol + 1] = "--"
-            print("undone: " + move.getFullChessNotation())
-
+            if self.bitboards is not None:
+                self.bitboards.refreshSquares(self.board, self.getChangedSquares(move))
+
+            self.repetitionCounts[self.zobristKey] -= 1
+            if self.repetitionCounts[self.zobristKey] == 0:
+                del self.repetitionCounts[self.zobristKey]
+            self.zobristLog.pop()
+            self.zobristKey = self.zobristLog[-1]
+
+            self.halfmoveClockLog.pop()
+            self.halfmoveClock = self.halfmoveClockLog[-1]
+            if not self.whiteToMove:
+                self.fullmoveNumber -= 1
+
+    @staticmethod
+    def getChangedSquares(move):
+        changedSquares = [(move.startRow, move.startCol), (move.endRow, move.endCol)]
+        if move.isEnPassantMove:
+            changedSquares.append((move.startRow, move.endCol))
+        if move.isCastleMove:
+            changedSquares += [(move.endRow, 0), (move.endRow, 7), (move.endRow, 3), (move.endRow, 5)]
+        return changedSquares
+
+    def hashSquares(self, squares):
+        key = 0
+        for r, c in squares:
+            piece = self.board[r][c]
+            if piece != "--":
+                key ^= ZOBRIST.pieces[piece][r * 8 + c]
+        return key
+
+    def hashState(self):
+        """
+        The part of the Zobrist key that is not on the board: side to move, castling rights and en passant square.
+        The en passant square is hashed only if a pawn is there to take it, otherwise the positions are the same.
+        """
+        key = 0 if self.whiteToMove else ZOBRIST.blackToMove
+        if self.currentCastlingRights.wks:
+            key ^= ZOBRIST.castling["wks"]
+        if self.currentCastlingRights.bks:
+            key ^= ZOBRIST.castling["bks"]
+        if self.currentCastlingRights.wqs:
+            key ^= ZOBRIST.castling["wqs"]
+        if self.currentCastlingRights.bqs:
+            key ^= ZOBRIST.castling["bqs"]
+        if self.enPassantPossible != ():
+            row, col = self.enPassantPossible
+            pawnRow, pawn = (row + 1, "wp") if self.whiteToMove else (row - 1, "bp")
+            if (col - 1 >= 0 and self.board[pawnRow][col - 1] == pawn) or \
+                    (col + 1 <= 7 and self.board[pawnRow][col + 1] == pawn):
+                key ^= ZOBRIST.enPassantCols[col]
+        return key
+
+    def isThreefoldRepetition(self):
+        return self.repetitionCounts.get(self.zobristKey, 0) >= 3
 
     def updateCastleRights(self, move):
         if move.pieceMoved == "wK":
@@ -185,12 +421,42 @@ class GameState:
                     self.currentCastlingRights.bqs = False
                 elif move.startCol == 7:  # right rook
                     self.currentCastlingRights.bks = False
+        # a rook captured on its home square takes the castle rights away too
+        if move.pieceCaptured == "wR":
+            if move.endRow == 7:
+                if move.endCol == 0:
+                    self.currentCastlingRights.wqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRights.wks = False
+        elif move.pieceCaptured == "bR":
+            if move.endRow == 0:
+                if move.endCol == 0:
+                    self.currentCastlingRights.bqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRights.bks = False
 
     """
     All moves considering checks
     """
 
     def getValidMoves(self):
+        if self.moveCache is not None:
+            entry = self.moveCache.get(self.zobristKey)
+            if entry is not None:
+                moves, self.checks, self.inCheck, self.inDoubleCheck, self.checkmate, self.stalemate = entry
+                return list(moves)
+        if self.bitboards is not None:
+            moves = self.getBitboardValidMoves()
+        else:
+            moves = self.getArrayValidMoves()
+        self.checkmate = len(moves) == 0 and self.inCheck
+        self.stalemate = len(moves) == 0 and not self.inCheck
+        if self.moveCache is not None:
+            self.moveCache.put(self.zobristKey, (tuple(moves), self.checks, self.inCheck, self.inDoubleCheck,
+                                                 self.checkmate, self.stalemate))
+        return moves
+
+    def getArrayValidMoves(self):
         tempEnPassantPossible = self.enPassantPossible
         moves = []
         self.inCheck, self.pins, self.checks, self.inDoubleCheck = self.checkForPinsAndChecks()
@@ -221,6 +487,9 @@ class GameState:
                     # get rid of any moves that don't block the check or move the king
                 for i in range(len(moves) - 1, -1, -1):
                     if moves[i].pieceMoved[1] != "K":
+                        # en passant can take the checking pawn without landing on its square
+                        if moves[i].isEnPassantMove and (moves[i].startRow, moves[i].endCol) in validSquares:
+                            continue
                         if not (moves[i].endRow, moves[i].endCol) in validSquares:
                             moves.remove(moves[i])
 
@@ -228,11 +497,6 @@ class GameState:
                 self.getKingMoves(kingRow, kingCol, moves)
         else:
             moves = self.getAllPossibleMoves()
-        if len(moves) == 0:
-            if self.inCheck:
-                self.checkmate = True
-            else:
-                self.stalemate = True
 
         self.enPassantPossible = tempEnPassantPossible
 
@@ -242,6 +506,34 @@ class GameState:
             self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
         return moves
 
+    def getBitboardValidMoves(self):
+        cr = self.currentCastlingRights
+        enPassantSquare = self.enPassantPossible[0] * 8 + self.enPassantPossible[1] if self.enPassantPossible else -1
+        moveTuples, checkers = self.bitboards.generateLegalMoves(self.whiteToMove, enPassantSquare,
+                                                                 (cr.wks, cr.bks, cr.wqs, cr.bqs))
+        toSquare = Bitboards.SQUARES
+        moves = []
+        for start, end, flag in moveTuples:
+            if flag == Bitboards.PROMOTION:
+                self.addPawnMoves(toSquare[start], toSquare[end], moves)
+            else:
+                moves.append(Move(toSquare[start], toSquare[end], self.board,
+                                  isEnPassantMove=flag == Bitboards.EN_PASSANT, castle=flag == Bitboards.CASTLE))
+
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        self.checks = []
+        for sq in Bitboards.squares(checkers):
+            checkRow, checkCol = Bitboards.SQUARES[sq]
+            dRow, dCol = checkRow - kingRow, checkCol - kingCol
+            if self.board[checkRow][checkCol][1] != "N":  # the same (direction) format as checkForPinsAndChecks
+                distance = max(abs(dRow), abs(dCol))
+                dRow, dCol = dRow // distance, dCol // distance
+            self.checks.append((checkRow, checkCol, dRow, dCol))
+        self.pins = []
+        self.inCheck = len(self.checks) > 0
+        self.inDoubleCheck = len(self.checks) == 2
+        return moves
+
     def checkForPinsAndChecks(self):
         pins = []  # squares where the allied pinned piece is and direction pinned from
         checks = []  # squares where enemy is applying a check
@@ -337,58 +629,52 @@ class GameState:
 
         if self.whiteToMove:  # look at the white pawn
             if self.board[r - 1][c] == "--":
-                if not piecePinned or pinDirection == (-1, 0):
-                    moves.append(Move((r, c), (r - 1, c), self.board))
+                if not piecePinned or pinDirection in ((-1, 0), (1, 0)):
+                    self.addPawnMoves((r, c), (r - 1, c), moves)
                     if r == 6 and self.board[r - 2][c] == "--":
-                        moves.append(Move((r, c), (r - 2, c), self.board))
+                        self.addPawnMoves((r, c), (r - 2, c), moves)
             if c - 1 >= 0:  # captures to the left
-                if not piecePinned or pinDirection == (-1, -1):
+                if not piecePinned or pinDirection in ((-1, -1), (1, 1)):
                     if self.board[r - 1][c - 1][0] == "b":
-                        moves.append(Move((r, c), (r - 1, c - 1), self.board))
+                        self.addPawnMoves((r, c), (r - 1, c - 1), moves)
                     elif (r - 1, c - 1) == self.enPassantPossible:
-                        gsCopy = copy.deepcopy(self)
-                        gsCopy.makeMove(Move((r, c), (r - 1, c - 1), self.board, isEnPassantMove=True))
-                        kingRow, kingCol = gsCopy.whiteKingLocation if not gsCopy.whiteToMove else \
-                            gsCopy.blackKingLocation
-                        if not gsCopy.squareUnderAttack(gsCopy.whiteToMove, kingRow, kingCol):
+                        if self.isEnPassantLegal(r, c, r - 1, c - 1):
                             moves.append(Move((r, c), (r - 1, c - 1), self.board, isEnPassantMove=True))
             if c + 1 <= 7:  # captures to the right
-                if not piecePinned or pinDirection == (-1, 1):
+                if not piecePinned or pinDirection in ((-1, 1), (1, -1)):
                     if self.board[r - 1][c + 1][0] == "b":
-                        moves.append(Move((r, c), (r - 1, c + 1), self.board))
+                        self.addPawnMoves((r, c), (r - 1, c + 1), moves)
                     elif (r - 1, c + 1) == self.enPassantPossible:
-                        gsCopy = copy.deepcopy(self)
-                        gsCopy.makeMove(Move((r, c), (r - 1, c + 1), self.board, isEnPassantMove=True))
-                        kingRow, kingCol = gsCopy.whiteKingLocation if not gsCopy.whiteToMove else gsCopy.blackKingLocation
-                        if not gsCopy.squareUnderAttack(gsCopy.whiteToMove, kingRow, kingCol):
+                        if self.isEnPassantLegal(r, c, r - 1, c + 1):
                             moves.append(Move((r, c), (r - 1, c + 1), self.board, isEnPassantMove=True))
         else:
             if self.board[r + 1][c] == "--":
-                if not piecePinned or pinDirection == (1, 0):
-                    moves.append(Move((r, c), (r + 1, c), self.board))
+                if not piecePinned or pinDirection in ((1, 0), (-1, 0)):
+                    self.addPawnMoves((r, c), (r + 1, c), moves)
                     if r == 1 and self.board[r + 2][c] == "--":
-                        moves.append(Move((r, c), (r + 2, c), self.board))
+                        self.addPawnMoves((r, c), (r + 2, c), moves)
             if c - 1 >= 0:  # captures to the left
-                if not piecePinned or pinDirection == (1, -1):
+                if not piecePinned or pinDirection in ((1, -1), (-1, 1)):
                     if self.board[r + 1][c - 1][0] == "w":
-                        moves.append(Move((r, c), (r + 1, c - 1), self.board))
+                        self.addPawnMoves((r, c), (r + 1, c - 1), moves)
                     elif (r + 1, c - 1) == self.enPassantPossible:
-                        gsCopy = copy.deepcopy(self)
-                        gsCopy.makeMove(Move((r, c), (r + 1, c - 1), self.board, isEnPassantMove=True))
-                        kingRow, kingCol = gsCopy.whiteKingLocation if not gsCopy.whiteToMove else gsCopy.blackKingLocation
-                        if not gsCopy.squareUnderAttack(gsCopy.whiteToMove, kingRow, kingCol):
+                        if self.isEnPassantLegal(r, c, r + 1, c - 1):
                             moves.append(Move((r, c), (r + 1, c - 1), self.board, isEnPassantMove=True))
             if c + 1 <= 7:  # captures to the right
-                if not piecePinned or pinDirection == (1, 1):
+                if not piecePinned or pinDirection in ((1, 1), (-1, -1)):
                     if self.board[r + 1][c + 1][0] == "w":
-                        moves.append(Move((r, c), (r + 1, c + 1), self.board))
+                        self.addPawnMoves((r, c), (r + 1, c + 1), moves)
                     elif (r + 1, c + 1) == self.enPassantPossible:
-                        gsCopy = copy.deepcopy(self)
-                        gsCopy.makeMove(Move((r, c), (r + 1, c + 1), self.board, isEnPassantMove=True))
-                        kingRow, kingCol = gsCopy.whiteKingLocation if not gsCopy.whiteToMove else gsCopy.blackKingLocation
-                        if not gsCopy.squareUnderAttack(gsCopy.whiteToMove, kingRow, kingCol):
+                        if self.isEnPassantLegal(r, c, r + 1, c + 1):
                             moves.append(Move((r, c), (r + 1, c + 1), self.board, isEnPassantMove=True))
 
+    def addPawnMoves(self, startSq, endSq, moves):
+        if endSq[0] == 0 or endSq[0] == 7:  # one move for every promoting piece
+            for piecePromoting in ("Q", "R", "B", "N"):
+                moves.append(Move(startSq, endSq, self.board, piecePromoting=piecePromoting))
+        else:
+            moves.append(Move(startSq, endSq, self.board))
+
     def getRookMoves(self, r, c, moves):
         piecePinned = False
         pinDirection = ()
@@ -502,49 +788,60 @@ class GameState:
                     else:
                         self.blackKingLocation = (r, c)
 
-    def squareUnderAttack(self, side, r, c):
-        if side:
-            return self.squareUnderWhiteAttack(r, c)
-        else:
-            print("here1")
-            return self.squareUnderBlackAttack(r, c)
-
-    def squareUnderBlackAttack(self, r, c):
-        gs = copy.deepcopy(self)
-        res = False
-        gs.whiteToMove = False
-        gs.board[r][c] = "wQ"
-        moves = gs.getAllPossibleMoves()
-
-        for move in moves:
-            print("generated in copy: " + str(move.getFullChessNotation()) + ", endRow:" + str(move.endRow) + ", endCol:" +
-                  str(move.endCol) + ", r:" + str(r) + ", c:" + str(c))
-            if move.endRow == r and move.endCol == c:
-                res = True
-                break
-            else:
-                res = False
-        return res
-
-    def squareUnderWhiteAttack(self, r, c):
-        gs = copy.deepcopy(self)
-        res = False
-        gs.whiteToMove = True
-        gs.board[r][c] = "bQ"
-        moves = gs.getAllPossibleMoves()
+    def isEnPassantLegal(self, r, c, endRow, endCol):
+        """
+        Plays the en passant capture on the board in place, looks if the own king is attacked and takes it back.
+        """
+        pieceMoved = self.board[r][c]
+        pieceCaptured = self.board[r][endCol]
+        self.board[r][c] = "--"
+        self.board[r][endCol] = "--"
+        self.board[endRow][endCol] = pieceMoved
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        legal = not self.squareUnderAttack(not self.whiteToMove, kingRow, kingCol)
+        self.board[endRow][endCol] = "--"
+        self.board[r][endCol] = pieceCaptured
+        self.board[r][c] = pieceMoved
+        return legal
 
-        for move in moves:
-            # print("generated: " + str(move.getChessNotation()) + ", endRow:" + str(move.endRow) + ", endCol:" +
-            #      str(move.endCol) + ", r:" + str(r) + ", c:" + str(c))
-            if move.endRow == r and move.endCol == c:
-                res = True
+    def squareUnderAttack(self, side, r, c):
+        """
+        Looks if the square is attacked by white (side is True) or black (side is False) pieces.
+        Works on the board directly: pawns, knights and king are looked up from the square, sliders along the rays.
+        """
+        enemyColor = "w" if side else "b"
+        pawnRow = r + 1 if side else r - 1  # white pawns attack upwards, black pawns - downwards
+        if 0 <= pawnRow <= 7:
+            if (c - 1 >= 0 and self.board[pawnRow][c - 1] == enemyColor + "p") or \
+                    (c + 1 <= 7 and self.board[pawnRow][c + 1] == enemyColor + "p"):
+                return True
+        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+        for m in knightMoves:
+            endRow = r + m[0]
+            endCol = c + m[1]
+            if 0 <= endRow <= 7 and 0 <= endCol <= 7 and self.board[endRow][endCol] == enemyColor + "N":
+                return True
+        directions = ((-1, 0), (0, -1), (0, 1), (1, 0), (-1, -1), (-1, 1), (1, -1), (1, 1))
+        for j in range(len(directions)):
+            d = directions[j]
+            for i in range(1, 8):
+                endRow = r + d[0] * i
+                endCol = c + d[1] * i
+                if not (0 <= endRow <= 7 and 0 <= endCol <= 7):
+                    break
+                endPiece = self.board[endRow][endCol]
+                if endPiece == "--":
+                    continue
+                if endPiece[0] == enemyColor:
+                    type = endPiece[1]
+                    if type == "Q" or (0 <= j <= 3 and type == "R") or (4 <= j <= 7 and type == "B") or \
+                            (i == 1 and type == "K"):
+                        return True
                 break
-            else:
-                res = False
-        return res
+        return False
 
     def getCastleMoves(self, r, c, moves):
-        if self.inCheck:
+        if self.inCheck or (r, c) != ((7, 4) if self.whiteToMove else (0, 4)):  # the king isn't on its home square
             return
         if (self.whiteToMove and self.currentCastlingRights.wks) or (
                 not self.whiteToMove and self.currentCastlingRights.bks):
@@ -554,18 +851,132 @@ class GameState:
             self.getQueenSideCastleMoves(r, c, moves)
 
     def getKingSideCastleMoves(self, r, c, moves):
-        if self.board[r][c + 1] == "--" and self.board[r][c + 2] == "--" and self.board[r][c + 3][1] == "R":
+        if self.board[r][c + 1] == "--" and self.board[r][c + 2] == "--" and \
+                self.board[r][c + 3] == self.board[r][c][0] + "R":
             if not self.squareUnderAttack(not self.whiteToMove, r, c + 1) and \
                     not self.squareUnderAttack(not self.whiteToMove, r, c + 2):
                 moves.append(Move((r, c), (r, c + 2), self.board, castle=True))
 
     def getQueenSideCastleMoves(self, r, c, moves):
         if self.board[r][c - 1] == "--" and self.board[r][c - 2] == "--" and self.board[r][c - 3] == "--" \
-                and self.board[r][c - 4][1] == "R":
+                and self.board[r][c - 4] == self.board[r][c][0] + "R":
             if not self.squareUnderAttack(not self.whiteToMove, r, c - 1) and \
                     not self.squareUnderAttack(not self.whiteToMove, r, c - 2):
                 moves.append(Move((r, c), (r, c - 2), self.board, castle=True))
 
+    def getShortNotation(self, move):
+        """
+        Standard algebraic notation of a valid move of the current position, without the check suffix.
+        The other pieces that could go to the same square are found by looking from the end square like
+        squareUnderAttack does, without generating the moves or changing the board.
+        """
+        if move.isCastleMove:
+            return "O-O" if move.endCol > move.startCol else "O-O-O"
+        endSquare = move.getRankFile(move.endRow, move.endCol)
+        piece = move.pieceMoved[1]
+        if piece == "p":
+            if move.startCol != move.endCol:
+                endSquare = Move.colsToFiles[move.startCol] + "x" + endSquare
+            return endSquare + ("=" + move.piecePromoting if move.isPawnPromotion else "")
+        capture = "x" if move.pieceCaptured != "--" else ""
+        if piece == "K":
+            return "K" + capture + endSquare
+
+        rivals = []  # the other pieces of the same kind attacking the end square
+        if piece == "N":
+            for d in SAN_KNIGHT_MOVES:
+                r = move.endRow + d[0]
+                c = move.endCol + d[1]
+                if 0 <= r <= 7 and 0 <= c <= 7 and self.board[r][c] == move.pieceMoved:
+                    rivals.append((r, c))
+        else:
+            for d in SAN_SLIDER_DIRECTIONS[piece]:
+                for i in range(1, 8):
+                    r = move.endRow + d[0] * i
+                    c = move.endCol + d[1] * i
+                    if not (0 <= r <= 7 and 0 <= c <= 7):
+                        break
+                    if self.board[r][c] != "--":
+                        if self.board[r][c] == move.pieceMoved:
+                            rivals.append((r, c))
+                        break
+        rivals = [(r, c) for (r, c) in rivals if (r, c) != (move.startRow, move.startCol) and
+                  not self.isPinnedAway(r, c, move.endRow, move.endCol)]
+        disambiguation = ""
+        if rivals:
+            if all(c != move.startCol for (_, c) in rivals):
+                disambiguation = Move.colsToFiles[move.startCol]
+            elif all(r != move.startRow for (r, _) in rivals):
+                disambiguation = Move.rowsToRanks[move.startRow]
+            else:
+                disambiguation = move.getRankFile(move.startRow, move.startCol)
+        return piece + disambiguation + capture + endSquare
+
+    def isPinnedAway(self, r, c, endRow, endCol):
+        """
+        Looks if the piece on (r, c) is pinned to its king so that it can't go to (endRow, endCol).
+        """
+        color = self.board[r][c][0]
+        kingRow, kingCol = self.whiteKingLocation if color == "w" else self.blackKingLocation
+        dr = r - kingRow
+        dc = c - kingCol
+        if not (dr == 0 or dc == 0 or abs(dr) == abs(dc)):
+            return False
+        d = ((dr > 0) - (dr < 0), (dc > 0) - (dc < 0))
+        if (endRow - kingRow) * d[1] == (endCol - kingCol) * d[0] and \
+                (endRow - kingRow) * d[0] + (endCol - kingCol) * d[1] > 0:
+            return False  # it stays on the line of the pin
+        sliders = ("Q", "R") if d[0] == 0 or d[1] == 0 else ("Q", "B")
+        row = kingRow + d[0]
+        col = kingCol + d[1]
+        behindPiece = False
+        while 0 <= row <= 7 and 0 <= col <= 7:
+            endPiece = self.board[row][col]
+            if (row, col) == (r, c):
+                behindPiece = True
+            elif endPiece != "--":
+                return behindPiece and endPiece[0] != color and endPiece[1] in sliders
+            row += d[0]
+            col += d[1]
+        return False
+
+    def getMoveLogSan(self):
+        """
+        The move log in standard algebraic notation with the check and mate suffixes from moveLogChecks.
+        """
+        return [move.getShortChessNotation() + SAN_SUFFIXES[check]
+                for move, check in zip(self.moveLog, self.moveLogChecks)]
+
+    def perft(self, depth):
+        """
+        Counts the leaf nodes of the legal move tree to the given depth.
+        """
+        if depth == 0:
+            return 1
+        moves = self.getValidMoves()
+        if depth == 1:
+            return len(moves)
+        recordShortNotation = self.recordShortNotation
+        self.recordShortNotation = False
+        nodes = 0
+        for move in moves:
+            self.makeMove(move)
+            nodes += self.perft(depth - 1)
+            self.undoMove()
+        self.recordShortNotation = recordShortNotation
+        return nodes
+
+    def perftDivide(self, depth):
+        """
+        Counts the leaf nodes under every legal move separately, to find the move a wrong count comes from.
+        """
+        divide = {}
+        for move in self.getValidMoves():
+            self.makeMove(move)
+            divide[move.getFullChessNotation()] = self.perft(depth - 1)
+            self.undoMove()
+        return divide
+
     def proposeMoveFromNotation(self, moveString):
         kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
         if moveString == "O-O":
@@ -580,19 +991,66 @@ class GameState:
             piecePromoting = "--"
             if len(moveString) == 7:
                 piecePromoting = moveString[6]
-            if self.enPassantPossible == (endRow, endCol):
-                return Move((startRow, startCol),
-                            (endRow, endCol), self.board, isEnPassantMove=True)
-            elif piecePromoting != "--":
-                if self.board[startRow][startCol][1] == "p" and endRow == 7 or endRow == 0:
-                    return Move((startRow, startCol),
-                            (endRow, endCol), self.board, piecePromoting=piecePromoting)
-                else:
-                    return Move((startRow, startCol),
-                                (endRow, endCol), self.board)
-            else:
-                return Move((startRow, startCol),
-                            (endRow, endCol), self.board)
+            # en passant is recognized by Move itself, the promoting piece is kept only if it's a promotion
+            return Move((startRow, startCol), (endRow, endCol), self.board, piecePromoting=piecePromoting)
+
+    def getMoveFromSan(self, san):
+        """
+        Finds the valid move written in standard algebraic notation ("Nbd7", "exd6", "e8=Q+", "O-O").
+        Raises ValueError if no valid move or more than one valid move fits.
+        """
+        san = san.rstrip("+#!?")
+        match = SAN_PATTERN.match(san.replace("0", "O"))
+        if match is None:
+            raise ValueError("Incorrect SAN: " + san)
+        castle, piece, fromFile, fromRank, endSquare, promotion = match.groups()
+        candidates = []
+        for move in self.getValidMoves():
+            if castle:
+                if move.isCastleMove and (move.endCol == 6) == (castle == "O-O"):
+                    candidates.append(move)
+                continue
+            if move.endCol != Move.filesToCols[endSquare[0]] or move.endRow != Move.ranksToRows[endSquare[1]] or \
+                    move.pieceMoved[1] != (piece if piece else "p") or move.isCastleMove:
+                continue
+            if (fromFile and move.startCol != Move.filesToCols[fromFile]) or \
+                    (fromRank and move.startRow != Move.ranksToRows[fromRank]):
+                continue
+            if move.isPawnPromotion and move.piecePromoting != (promotion if promotion else "Q"):
+                continue
+            candidates.append(move)
+        if len(candidates) != 1:
+            raise ValueError(("Ambiguous" if candidates else "Illegal") + " SAN move: " + san)
+        return candidates[0]
+
+
+class MoveCache:
+    def __init__(self, maxSize):
+        """
+        LRU cache of the legal moves together with the check/mate/stalemate status, keyed by the position hash.
+        """
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
 
 
 class CastleRights:
@@ -602,6 +1060,9 @@ class CastleRights:
         self.wqs = wqs
         self.bqs = bqs
 
+    def copy(self):
+        return CastleRights(self.wks, self.bks, self.wqs, self.bqs)
+
 
 class Move:
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}  # dictionary rank-row
@@ -609,73 +1070,78 @@ class Move:
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}  # dictionary file-col
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
+    promotionCodes = {"--": 0, "Q": 1, "R": 2, "B": 3, "N": 4}
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured", "moveID",
+                 "piecePromoting", "isPawnPromotion", "isEnPassantMove", "isCastleMove", "fullNotation",
+                 "shortNotation")
+
     def __init__(self, startSq, endSq, board, isEnPassantMove=False, castle=False, piecePromoting="--"):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-        # unique identifier of the move from 0 to 7777
-        # For example: 0002 = move from row 0, col 0 to row 0, col 2
-        self.piecePromoting = piecePromoting
-        self.isPawnPromotion = False
-        if (self.pieceMoved == "wp" and self.endRow == 0) or (self.pieceMoved == "bp" and self.endRow == 7):
-            self.isPawnPromotion = True
+        startRow, startCol = startSq
+        endRow, endCol = endSq
+        self.startRow = startRow
+        self.startCol = startCol
+        self.endRow = endRow
+        self.endCol = endCol
+        pieceMoved = board[startRow][startCol]
+        pieceCaptured = board[endRow][endCol]
+        self.pieceMoved = pieceMoved
 
+        self.isPawnPromotion = False
+        if pieceMoved[1] == "p":
+            if (pieceMoved == "wp" and endRow == 0) or (pieceMoved == "bp" and endRow == 7):
+                self.isPawnPromotion = True
+            if pieceCaptured == "--" and abs(startRow - endRow) == 1 and abs(startCol - endCol) == 1:
+                isEnPassantMove = True
+        elif pieceMoved[1] == "K" and (endCol - startCol == 2 or endCol - startCol == -2):
+            castle = True
+        self.piecePromoting = piecePromoting if self.isPawnPromotion else "--"
         self.isEnPassantMove = isEnPassantMove
-        if self.pieceMoved[1] == "p" and abs(self.startRow - self.endRow) == 1 \
-                and abs(self.startCol - self.endCol) == 1 and board[self.endRow][self.endCol] == "--":
-            self.isEnPassantMove = True
-
-        if self.isEnPassantMove:
-            self.pieceCaptured = "wp" if self.pieceMoved == "bp" else "bp"
-
+        if isEnPassantMove:
+            pieceCaptured = "wp" if pieceMoved == "bp" else "bp"
+        self.pieceCaptured = pieceCaptured
         self.isCastleMove = castle
-        if self.pieceMoved[1] == "K" and (self.endCol - self.startCol == 2 or self.endCol - self.startCol == -2):
-            self.isCastleMove = True
+
+        # unique identifier of the move packed into 17 bits:
+        # start square (6 bits), end square (6 bits), promoting piece (3 bits), en passant and castle flags
+        self.moveID = (startRow * 8 + startCol) | (endRow * 8 + endCol) << 6 | \
+            self.promotionCodes[self.piecePromoting] << 12 | isEnPassantMove << 15 | castle << 16
+        self.fullNotation = None  # computed on the first getFullChessNotation call
+        self.shortNotation = None  # computed by GameState.getShortNotation before the move is made
 
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
 
     def getFullChessNotation(self):
-        if self.isCastleMove:
-            if self.endCol - self.startCol == 2:
-                return "O-O"
+        if self.fullNotation is None:
+            if self.isCastleMove:
+                if self.endCol - self.startCol == 2:
+                    self.fullNotation = "O-O"
+                else:
+                    self.fullNotation = "O-O-O"
             else:
-                return "O-O-O"
-        else:
-            res = self.pieceMoved[1] if self.pieceMoved[1] != "p" else ""
-            return res + self.getRankFile(self.startRow, self.startCol) + ("-" if self.pieceCaptured == "--" else "x") + \
-                   self.getRankFile(self.endRow, self.endCol) + (self.piecePromoting if self.isPawnPromotion else "")
-
-    def getShortChessNotation(self, gs):
-        res = self.pieceMoved[1] if self.pieceMoved[1] != "p" else ""
-        res += ("x" if self.pieceCaptured != "--" else "")
-        gs.board[self.endRow][self.endCol] = "--"
-        moves = gs.getAllPossibleMoves()
-        sameEndSquareMoves = []
-        for move in moves:
-            print("generated: " + move.getFullChessNotation())
-            if move.pieceMoved == self.pieceMoved and move.endRow == self.endRow and move.endCol == self.endCol:
-                sameEndSquareMoves.append(move)
-        for move in sameEndSquareMoves:
-            if len(sameEndSquareMoves) == 1:
-                if move.startRow == self.startRow:
-                    res += str(self.colsToFiles[self.startCol])
-                elif move.startCol == self.startCol:
-                    res += str(self.rowsToRanks[self.startRow])
-            elif len(sameEndSquareMoves) > 1:
-                return self.getFullChessNotation()
-
-        res += self.getRankFile(self.endRow, self.endCol)
-        if self.isPawnPromotion:
-            res += self.piecePromoting
-        return res
+                res = self.pieceMoved[1] if self.pieceMoved[1] != "p" else ""
+                self.fullNotation = res + self.getRankFile(self.startRow, self.startCol) + \
+                    ("-" if self.pieceCaptured == "--" else "x") + self.getRankFile(self.endRow, self.endCol) + \
+                    (self.piecePromoting if self.isPawnPromotion else "")
+        return self.fullNotation
+
+    def getShortChessNotation(self, gs=None):
+        """
+        Standard algebraic notation of the move without the check suffix ("Nbd7", "exd6", "e8=Q", "O-O").
+        It's stored when the move is made; before that gs must be the position the move is played from.
+        """
+        if self.shortNotation is None:
+            self.shortNotation = gs.getShortNotation(self)
+        return self.shortNotation
 
     def __eq__(self, other):
         if isinstance(other, Move):
-            return self.moveID == other.moveID and self.isCastleMove == other.isCastleMove \
-                   and self.isEnPassantMove == other.isEnPassantMove and self.isPawnPromotion == other.isPawnPromotion
+            return self.moveID == other.moveID  # squares, promoting piece and flags are all packed into moveID
         return False
+
+    def __hash__(self):
+        return self.moveID
+
+    def __repr__(self):
+        return "Move(" + self.getFullChessNotation() + ", moveID=" + str(self.moveID) + ", pieceMoved=" + \
+            self.pieceMoved + ", pieceCaptured=" + self.pieceCaptured + ")"
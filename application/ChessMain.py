@@ -4,10 +4,11 @@ This file is responsible for displaying current GameState information
 import pyaudio
 import pygame as p
 import pyttsx3
-from vosk import KaldiRecognizer
 
 import ChessEngine
+import EngineWorker
 import Sayer
+import VoiceWorker
 import VoskAssistant
 from translator import NotationTranslator
 
@@ -19,7 +20,19 @@ MOVELOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8  # dimension of the board
 SQUARE_SIZE = BOARD_HEIGHT / DIMENSION
 MAX_FPS = 15
+ANIMATION_FPS = 60  # frame rate while a move is animated
+ANIMATION_FRAMES_PER_SQUARE = 4  # frames to move one square
 MOVELOG_FONT_SIZE = 20
+MOVELOG_FULL_NOTATION = False  # the move log shows "Ng1-f3" instead of the short notation "Nf3"
+USE_BITBOARDS = False  # generate the legal moves from the bitboard representation
+AUTO_DRAW_ON_REPETITION = False  # end the game as a draw when a position occurs for the third time
+ENGINE_TIME_LIMIT = 5.0  # seconds the engine thinks on a move
+VOICE_EARLY_COMMIT = True  # make a spoken move as soon as the partial result names exactly one valid move
+VOICE_GRAMMAR = True  # let the recognizer hear only the valid moves and the commands
+VOICE_FUZZY_RESOLVE = True  # match the spoken text against every valid move instead of the exact notation only
+TTS_CLIP_CACHE = True  # play the spoken phrases from pre-rendered audio clips
+TTS_WARM_UP_PHRASES = ["Делаю ход", "Шах", "Двойной шах", "Пат", "И мат", "Отменяю ход", "Сброс игры",
+                       "Невозможный ход", "Ход не рас поз нан", "Голосовой режим включен.", "Отмена голосового режима"]
 
 IMAGES = {}
 
@@ -42,29 +55,48 @@ def main():
     screen = p.display.set_mode((CLOCK_PANEL_WIDTH + BOARD_WIDTH + MOVELOG_PANEL_WIDTH, BOARD_HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    gs = ChessEngine.GameState()
+    gs = ChessEngine.GameState(useBitboards=USE_BITBOARDS)
     validMoves = gs.getValidMoves()
     moveLogFont = p.font.SysFont("Helvitca", MOVELOG_FONT_SIZE, False, False)
     moveMade = False  # A flag responsible for if a move is made
     animate = False  # Flag responsible for animation
     loadImages()  # Do this only once
+    renderer = Renderer(screen, moveLogFont)
     running = True  # Flag responsible for if an app is running
     squareSelected = ()
     playerClicks = []
     gameOver = False
     voicing = False
-    engine = pyttsx3.init()
-    sayer = Sayer.Sayer(engine, "ru")
+    clipCache = Sayer.ClipCache() if TTS_CLIP_CACHE else None
+    sayer = Sayer.Sayer(pyttsx3.init, "ru", asynchronous=True, clipCache=clipCache,
+                        warmUpPhrases=TTS_WARM_UP_PHRASES)  # makes the TTS engine and speaks on its own thread
     audioManager = pyaudio.PyAudio()
+    audioSession = None  # the microphone stream and the recognizer, opened when the voice mode is first entered
+    voiceWorker = None  # recognizes the speech off the main thread
+    translator = NotationTranslator.NotationTranslator()
+    grammarKey = None  # the position the recognizer grammar was built for
     currentPiecePromoting = "--"
+    engineWorker = EngineWorker.EngineWorker(ENGINE_TIME_LIMIT)  # searches off the main thread
+    engineWorker.start()
+    engineThinking = False
     while running:
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
                 voicing = False
+                engineWorker.shutdown()
+                sayer.shutdown()
+                if audioSession is not None:
+                    print(audioSession.getLatencySummary())
+                    voiceWorker.shutdown()  # closes the audio session
                 audioManager.terminate()
+                if gs.moveCache is not None:
+                    print("Move cache: " + str(gs.moveCache.hits) + " hits, " + str(gs.moveCache.misses) + " misses")
             # mouse handler
-            elif e.type == p.MOUSEBUTTONDOWN and not voicing:
+            elif e.type == p.MOUSEWHEEL:  # scroll the move log
+                if renderer.moveLogPanel.rect.collidepoint(p.mouse.get_pos()):
+                    renderer.moveLogPanel.scroll(-e.y)
+            elif e.type == p.MOUSEBUTTONDOWN and e.button not in (4, 5):  # 4 and 5 are the wheel
                 if not gameOver:
                     location = p.mouse.get_pos()
                     col = int(location[0] // SQUARE_SIZE)
@@ -78,35 +110,138 @@ def main():
                             squareSelected = (row, col)
                             playerClicks.append(squareSelected)
                     if len(playerClicks) == 2:
-                        move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
+                        move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board,
+                                                piecePromoting=currentPiecePromoting)
+                        if move.isPawnPromotion and move.piecePromoting == "--":
+                            print("Please specify the promoting piece: 1 - queen, 2 - rook, "
+                                  "3 - bishop, 4 - knight")
 
                         for i in range(len(validMoves)):
                             if move == validMoves[i]:
-                                attrs = vars(validMoves[i])
-                                print(', '.join("%s: %s" % item for item in attrs.items()))
-                                if move.isPawnPromotion:
-                                    if currentPiecePromoting == "--":
-                                        print("Please specify the promoting piece: 1 - queen, 2 - rook, "
-                                              "3 - bishop, 4 - knight")
-                                        continue
-                                    else:
-                                        move.piecePromoting = currentPiecePromoting
-                                        currentPiecePromoting = "--"
-                                animate, moveMade = makeMoveAndAnimate(gs, move)
+                                print(repr(validMoves[i]))
+                                currentPiecePromoting = "--"
+                                animate, moveMade = makeMoveAndAnimate(gs, validMoves[i])
                                 print("turn: " + ("white" if gs.whiteToMove else "black"))
                                 # undo selecting
                                 squareSelected = ()
                                 playerClicks = []
+                                break
 
                         if not moveMade:
-                            attrs = vars(move)
-                            print(', '.join("%s: %s" % item for item in attrs.items()))
+                            print(repr(move))
                             print(move.getFullChessNotation() + " not valid!")
                             squareSelected = ()
                             playerClicks = []
+            # engine handler
+            elif e.type == EngineWorker.ENGINE_RESULT_EVENT:
+                engineThinking = False
+                print("Engine: " + str(e.result))
+                if e.positionKey == gs.zobristKey and not gameOver:  # the board hasn't changed meanwhile
+                    for i in range(len(validMoves)):
+                        if validMoves[i].moveID == e.moveID:
+                            animate, moveMade = makeMoveAndAnimate(gs, validMoves[i])
+                            squareSelected = ()
+                            playerClicks = []
+                            break
+            # voice handler
+            elif e.type == VoiceWorker.VOICE_PARTIAL_EVENT and voicing and voiceWorker.isCurrent(e):
+                p.display.set_caption("Voice: " + e.text)
+                if VOICE_EARLY_COMMIT and not gameOver and e.text and \
+                        not any(command in e.text for command in ("стоп", "отмен", "сброс")):
+                    res, move = VoskAssistant.matchSpokenMove(gs, validMoves, e.text, translator)
+                    if move is not None:  # the beginning of the utterance already names one valid move
+                        animate, moveMade = makeMoveAndAnimate(gs, move)
+                        audioSession.reportLatency(res + ", early commit", e.captureTime)
+                        audioSession.countUtterance(True)
+                        print("Reformatted from the partial result: " + res)
+                        announceMove(sayer, gs, res)
+                        voiceWorker.startListening()  # the rest of the utterance must not be taken as a new move
+            elif e.type == VoiceWorker.VOICE_ERROR_EVENT and voicing:
+                print("Voice recognition error: " + repr(e.error))
+                sayer.say("Ошибка распознавания. Отмена голосового режима")
+                voicing = False
+            elif e.type == VoiceWorker.VOICE_TEXT_EVENT and voicing and voiceWorker.isCurrent(e):
+                text = e.text
+                print("Received: " + text)
+                p.display.set_caption("Voice: " + text)
+                understood = True  # a command or a valid move
+                if "стоп" in text:
+                    voicing = False
+                    voiceWorker.stopListening()
+                    sayer.say("Отмена голосового режима")
+                    print("voice play mode disabled")
+                elif "отмен" in text:
+                    sayer.cancel()  # the announcement of the undone move is stale
+                    sayer.say("Отменяю ход")
+                    engineWorker.cancel()
+                    engineThinking = False
+                    gs.undoMove()
+                    moveMade = True
+                    animate = False
+                    if gameOver:
+                        gameOver = not gameOver
+                        gs.checkmate = False
+                        gs.stalemate = False
+                elif "сброс" in text:
+                    sayer.cancel()
+                    sayer.say("Сброс игры")
+                    engineWorker.cancel()
+                    engineThinking = False
+                    gs = ChessEngine.GameState(useBitboards=USE_BITBOARDS)
+                    validMoves = gs.getValidMoves()
+                    renderer.stopAnimation()
+                    gameOver = False
+                    moveMade = False
+                    animate = False
+                elif gameOver:
+                    sayer.say("Игра окончена. Пожалуйста, перезапустите игру или отмените ход.")
+                else:
+                    understood = False
+                    move = None
+                    if VOICE_FUZZY_RESOLVE:  # forgives a misheard or left out word if only one valid move fits
+                        move, candidates = translator.resolveMove(text, validMoves)
+                    if move is not None:
+                        res = translator.moveNotation(move)
+                        animate, moveMade = makeMoveAndAnimate(gs, move)
+                        understood = True
+                        audioSession.reportLatency(res, e.speechEndTime)
+                        print("Resolved: " + res + " (cost %.2f)" % candidates[0][0])
+                        announceMove(sayer, gs, res)
+                    else:
+                        spokenMove = translator.translate(text)
+                        res = spokenMove.getNotation()
+                        if not spokenMove.isComplete():
+                            sayer.say("Ход не рас поз нан")
+                            print("Sorry, didn't recognize the move. Please repeat again:" + res)
+                        else:
+                            move = gs.proposeMoveFromNotation(res)
+                            if move.isPawnPromotion and move.piecePromoting == "--":
+                                sayer.say("Ход не верен. Укажите фигуру превращения")
+                                print("Specify the promoting piece")
+                            else:
+                                for i in range(len(validMoves)):
+                                    if move == validMoves[i]:
+                                        animate, moveMade = makeMoveAndAnimate(gs, validMoves[i])
+                                        understood = True
+                                        break
+                                if understood:
+                                    audioSession.reportLatency(res, e.speechEndTime)
+                                    print("Reformatted: " + res)
+                                    announceMove(sayer, gs, res)
+                                else:
+                                    print("Incorrect move.")
+                                    sayer.say("Невозможный ход")
+                                    if sayer.sayMove(res):
+                                        raise TypeError("Error in Sayer!")
+                audioSession.countUtterance(understood)
+                if voicing:
+                    voiceWorker.startListening()  # the events already posted are stale, the answer itself is muted
             # button handler
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  # undo move if Z is pressed
+                    engineWorker.cancel()
+                    sayer.cancel()
+                    engineThinking = False
                     gs.undoMove()
                     squareSelected = ()
                     playerClicks = []
@@ -118,8 +253,12 @@ def main():
                         gs.stalemate = False
 
                 if e.key == p.K_r:  # reset the board
-                    gs = ChessEngine.GameState()
+                    engineWorker.cancel()
+                    sayer.cancel()
+                    engineThinking = False
+                    gs = ChessEngine.GameState(useBitboards=USE_BITBOARDS)
                     validMoves = gs.getValidMoves()
+                    renderer.stopAnimation()
                     gameOver = False
                     squareSelected = ()
                     playerClicks = []
@@ -130,11 +269,23 @@ def main():
                     if not voicing:
                         print("Voice play mode is chosen.")
                         sayer.say("Голосовой режим включен.")
+                        if audioSession is None:
+                            audioSession = VoskAssistant.AudioSession(audioManager, model)
+                            voiceWorker = VoiceWorker.VoiceWorker(audioSession, sayer.isSpeaking)
+                            voiceWorker.start()
+                        voiceWorker.startListening()
+                        grammarKey = None
                         voicing = True
                     else:
                         print("Voice play mode disabled.")
+                        voiceWorker.stopListening()
                         sayer.say("Отмена голосового режима")
                         voicing = False
+                if e.key == p.K_e:  # let the engine make a move for the side to move
+                    if not gameOver and not engineThinking:
+                        print("Engine is thinking...")
+                        engineWorker.submitSearch(gs)
+                        engineThinking = True
                 if e.key == p.K_1:  # queen
                     currentPiecePromoting = "Q"
                 if e.key == p.K_2:  # rook
@@ -144,90 +295,43 @@ def main():
                 if e.key == p.K_4:  # knight
                     currentPiecePromoting = "N"
 
-        if voicing:
-            rec = KaldiRecognizer(model, 16000)
-            stream = audioManager.open(format=pyaudio.paInt16, channels=1, rate=16000, input=True,
-                                       frames_per_buffer=8000)
-            stream.start_stream()
-            for text in VoskAssistant.listen(stream, rec):
-                print("Received: " + text)
-                translator = NotationTranslator.NotationTranslator()
-                if "стоп" in text:
-                    voicing = False
-                    sayer.say("Отмена голосового режима")
-                    print("voice play mode disabled")
-                    stream.close()
-                    break
-                if "отмен" in text:
-                    sayer.say("Отменяю ход")
-                    gs.undoMove()
-                    moveMade = True
-                    animate = False
-                    if gameOver:
-                        gameOver = not gameOver
-                        gs.checkmate = False
-                        gs.stalemate = False
-                    break
-                if "сброс" in text:
-                    sayer.say("Сброс игры")
-                    gs = ChessEngine.GameState()
-                    validMoves = gs.getValidMoves()
-                    gameOver = False
-                    moveMade = False
-                    animate = False
-                    break
-                if not gameOver:
-                    res = translator.reformatSpeech(str(text))
-                    if (len(res) < 6 and res != "O-O" and res != "O-O-O") or res == "" or "(-)" in res \
-                            or "[-]" in res or "Unknown" in res:
-                        sayer.say("Ход не рас поз нан")
-                        print("Sorry, didn't recognize the move. Please repeat again:" + res)
-                        break
-                    move = gs.proposeMoveFromNotation(res)
-                    if move.isPawnPromotion and move.piecePromoting == "--":
-                        sayer.say("Ход не верен. Укажите фигуру превращения")
-                        print("Specify the promoting piece")
-                        break
-                    for i in range(len(validMoves)):
-                        if move == validMoves[i]:
-                            animate, moveMade = makeMoveAndAnimate(gs, move)
-                    if moveMade:
-                        print("Reformatted: " + res)
-                        sayer.say("Делаю ход")
-                        if sayer.sayMove(res):
-                            raise TypeError("Error in Sayer!")
-                        if gs.inCheck and not gs.inDoubleCheck:
-                            sayer.say("Шах")
-                        if gs.inDoubleCheck:
-                            sayer.say("Двойной шах")
-                        if gs.stalemate:
-                            sayer.say("Пат")
-                        if gs.checkmate:
-                            sayer.say("И мат")
-                    else:
-                        print("Incorrect move.")
-                        sayer.say("Невозможный ход")
-                        if sayer.sayMove(res):
-                            raise TypeError("Error in Sayer!")
-                else:
-                    sayer.say("Игра окончена. Пожалуйста, перезапустите игру или отмените ход.")
-            stream.close()
         if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
-            validMoves = gs.getValidMoves()
+                renderer.startAnimation(gs.moveLog[-1], gs.board)
+            else:
+                renderer.stopAnimation()
+            validMoves = gs.getValidMoves()  # already cached by makeMove/undoMove
             moveMade = False
             animate = False
+        if voicing and VOICE_GRAMMAR and grammarKey != gs.zobristKey:  # rebuilt after every move, undo and reset
+            voiceWorker.setGrammar(translator.buildGrammar(validMoves))
+            grammarKey = gs.zobristKey
 
-        drawGameState(screen, gs, validMoves, squareSelected, moveLogFont)
-
+        endGameText = None
         if gs.checkmate or gs.stalemate:
             gameOver = True
-            text = "Stalemate" if gs.stalemate else "Black wins by checkmate" if gs.whiteToMove else "White wins by " \
-                                                                                                     "checkmate "
-            drawEndGameText(screen, text)
-        clock.tick(MAX_FPS)
-        p.display.flip()
+            endGameText = "Stalemate" if gs.stalemate else "Black wins by checkmate" if gs.whiteToMove else \
+                "White wins by checkmate"
+        elif AUTO_DRAW_ON_REPETITION and gs.isThreefoldRepetition():
+            gameOver = True
+            endGameText = "Draw by threefold repetition"
+        renderer.draw(gs, validMoves, squareSelected, endGameText)
+        clock.tick(ANIMATION_FPS if renderer.isAnimating() else MAX_FPS)
+        renderer.update()
+
+
+def announceMove(sayer, gs, res):
+    sayer.say("Делаю ход")
+    if sayer.sayMove(res):
+        raise TypeError("Error in Sayer!")
+    if gs.inCheck and not gs.inDoubleCheck:
+        sayer.say("Шах")
+    if gs.inDoubleCheck:
+        sayer.say("Двойной шах")
+    if gs.stalemate:
+        sayer.say("Пат")
+    if gs.checkmate:
+        sayer.say("И мат")
 
 
 def makeMoveAndAnimate(gs, move):
@@ -242,28 +346,110 @@ Highlight the squares where pieces can move to
 """
 
 
-def highlightSquares(screen, gs, validMoves, sqSelected):
+def getHighlights(gs, validMoves, sqSelected):
+    highlights = {}  # (row, col) -> "selected" or "target"
     if sqSelected != ():
         r, c = sqSelected
         if gs.board[r][c][0] == ("w" if gs.whiteToMove else "b"):  # sqSelected is a piece that can be moved
-            # highlight the square
-            s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-            s.set_alpha(100)  # transparency value: 0 -> completely transparent, 255 - opaque
-            s.fill(p.Color("blue"))
-            screen.blit(s, (c * SQUARE_SIZE, r * SQUARE_SIZE))
             # highlight moves from the square
-            s.fill(p.Color("yellow"))
             for m in validMoves:
                 if m.startRow == r and m.startCol == c:
-                    screen.blit(s, (SQUARE_SIZE * m.endCol, SQUARE_SIZE * m.endRow))
-
-
-def drawGameState(screen, gs, validMoves, sqSelected, moveLogFont):
-    drawBoard(screen)
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces(screen, gs.board)
-    drawMoveLog(screen, gs, moveLogFont, True)
-    drawClockPanel(screen, gs)
+                    highlights[(m.endRow, m.endCol)] = "target"
+            highlights[(r, c)] = "selected"
+    return highlights
+
+
+class Renderer:
+    def __init__(self, screen, moveLogFont):
+        """
+        Draws the game state with dirty rectangles: a square is repainted from the cached board surface only when
+        its piece or highlight changes, the move log and the clock panel only when they change,
+        and only the repainted rectangles are sent to the display.
+        """
+        self.screen = screen
+        self.moveLogPanel = MoveLogPanel(moveLogFont, MOVELOG_FULL_NOTATION)
+        self.boardSurface = p.Surface((BOARD_WIDTH, BOARD_HEIGHT))
+        drawBoard(self.boardSurface)
+        self.highlights = {}
+        for name, color in (("selected", "blue"), ("target", "yellow")):
+            self.highlights[name] = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
+            self.highlights[name].set_alpha(100)  # transparency value: 0 -> completely transparent, 255 - opaque
+            self.highlights[name].fill(p.Color(color))
+        self.dirtyRects = []
+        self.animation = None
+        self.invalidate()
+
+    def startAnimation(self, move, board):
+        self.stopAnimation()
+        self.animation = MoveAnimation(move, board, self.boardSurface, p.time.get_ticks())
+
+    def stopAnimation(self):
+        """
+        Ends the running animation, the squares it has drawn over are repainted by the next draw.
+        """
+        if self.animation is not None:
+            rect = self.animation.rect
+            for r in range(int(rect.top // SQUARE_SIZE), int(rect.bottom // SQUARE_SIZE)):
+                for c in range(int(rect.left // SQUARE_SIZE), int(rect.right // SQUARE_SIZE)):
+                    self.shownSquares[r][c] = None
+            self.animation = None
+
+    def isAnimating(self):
+        return self.animation is not None
+
+    def invalidate(self):
+        """
+        Forgets what is on the screen, the next draw repaints everything.
+        """
+        self.shownSquares = [[None] * DIMENSION for _ in range(DIMENSION)]  # (piece, highlight) of every square
+        self.moveLogPanel.dirty = True
+        self.shownWhiteToMove = None
+        self.shownEndGameText = None
+
+    def draw(self, gs, validMoves, sqSelected, endGameText=None):
+        if self.animation is not None:
+            if self.animation.isFinished(p.time.get_ticks()):
+                self.stopAnimation()
+            else:
+                endGameText = None  # shown when the last move has arrived
+        if endGameText != self.shownEndGameText:  # the text covers the middle of the board
+            self.shownSquares = [[None] * DIMENSION for _ in range(DIMENSION)]
+        highlights = getHighlights(gs, validMoves, sqSelected)
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                state = (gs.board[r][c], highlights.get((r, c)))
+                if self.shownSquares[r][c] != state:
+                    self.drawSquare(r, c, *state)
+                    self.shownSquares[r][c] = state
+        if self.animation is not None:
+            self.dirtyRects.append(self.animation.draw(self.screen, p.time.get_ticks()))
+        if endGameText != self.shownEndGameText:
+            if endGameText is not None:
+                drawEndGameText(self.screen, endGameText)
+            self.shownEndGameText = endGameText
+        self.moveLogPanel.sync(gs)
+        if self.moveLogPanel.dirty:
+            self.dirtyRects.append(self.moveLogPanel.draw(self.screen))
+        if gs.whiteToMove != self.shownWhiteToMove:
+            self.dirtyRects.append(drawClockPanel(self.screen, gs))
+            self.shownWhiteToMove = gs.whiteToMove
+
+    def drawSquare(self, r, c, piece, highlight):
+        rect = p.Rect(c * SQUARE_SIZE, r * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+        self.screen.blit(self.boardSurface, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        self.dirtyRects.append(rect)
+
+    def update(self):
+        """
+        Sends the repainted rectangles to the display, nothing is done if nothing has changed.
+        """
+        if self.dirtyRects:
+            p.display.update(self.dirtyRects)
+            self.dirtyRects = []
 
 
 # todo: make whiteToMove sign to the left
@@ -295,39 +481,88 @@ def drawClockPanel(screen, gs):
     blackMoveColor = p.Color("red") if not gs.whiteToMove else p.Color("green")
     p.draw.rect(screen, whiteMoveColor, blackTurnRect)
     p.draw.rect(screen, blackMoveColor, whiteTurnRect)
-
-
-def drawMoveLog(screen, gs, moveLogFont, ifFullNotation):
-    moveLogRect = p.Rect(BOARD_WIDTH, 0, MOVELOG_PANEL_WIDTH, MOVELOG_PANEL_HEIGHT)
-    p.draw.rect(screen, p.Color("black"), moveLogRect)
-    moveLog = gs.moveLog
-    checksLog = gs.moveLogChecks
-    moveTexts = []
-    movesPerRow = 3
-    for i in range(0, len(moveLog), 2):
-        moveString = str(i // 2 + 1) + ". " + (moveLog[i].getFullChessNotation() if ifFullNotation
-                                               else moveLog[i].getShortChessNotation(gs)) + str(checksLog[i])
-        if i + 1 < len(moveLog):  # make sure black made a move
-            moveString += " " + moveLog[i + 1].getFullChessNotation() + str(checksLog[i + 1]) + " "
-        moveTexts.append(moveString)
-
-        if i >= 150:
-            moveTexts = moveTexts[1:]
-
-
-    padding = 5
-    paddingY = padding
-    lineSpacing = 2
-
-    for i in range(0, len(moveTexts), movesPerRow):
-        text = ""
-        for j in range(movesPerRow):
-            if i + j < len(moveTexts):
-                text += moveTexts[i + j]
-        textObject = moveLogFont.render(text, 1, p.Color("White"))
-        textLocation = moveLogRect.move(padding, paddingY)
-        screen.blit(textObject, textLocation)
-        paddingY += textObject.get_height() + lineSpacing
+    return moveLogRect
+
+
+class MoveLogPanel:
+    def __init__(self, moveLogFont, ifFullNotation=True):
+        """
+        The move log panel. Every line is rendered once and kept as a surface; when moves are undone, only the lines
+        from the first changed move are rendered again. The whole game is kept, the panel scrolls over it and
+        follows the last move unless it is scrolled up.
+        """
+        self.moveLogFont = moveLogFont
+        self.ifFullNotation = ifFullNotation
+        self.rect = p.Rect(BOARD_WIDTH, 0, MOVELOG_PANEL_WIDTH, MOVELOG_PANEL_HEIGHT)
+        self.padding = 5
+        self.lineHeight = moveLogFont.get_linesize() + 2
+        self.visibleLines = (MOVELOG_PANEL_HEIGHT - 2 * self.padding) // self.lineHeight
+        self.movesPerRow = 3
+        self.shownMoves = []  # the moves of the log that are rendered
+        self.moveTexts = []  # the notation of every half-move
+        self.lines = []  # rendered surface of every line
+        self.firstLine = 0  # the first visible line
+        self.followLastMove = True
+        self.dirty = True
+
+    def sync(self, gs):
+        """
+        Brings the rendered lines up to date with gs.moveLog.
+        """
+        moveLog = gs.moveLog
+        shownCount = min(len(self.shownMoves), len(moveLog))
+        for i in range(shownCount):
+            if self.shownMoves[i] is not moveLog[i]:  # undone and replaced by another move, or a new game
+                shownCount = i
+                break
+        if shownCount == len(self.shownMoves) == len(moveLog):
+            return
+        del self.shownMoves[shownCount:]
+        del self.moveTexts[shownCount:]
+        for i in range(shownCount, len(moveLog)):
+            move = moveLog[i]
+            self.shownMoves.append(move)
+            if self.ifFullNotation:
+                self.moveTexts.append(move.getFullChessNotation() + gs.moveLogChecks[i])
+            else:
+                self.moveTexts.append(move.getShortChessNotation() + ChessEngine.SAN_SUFFIXES[gs.moveLogChecks[i]])
+
+        halfMovesPerLine = 2 * self.movesPerRow
+        firstChangedLine = shownCount // halfMovesPerLine
+        del self.lines[firstChangedLine:]
+        for i in range(firstChangedLine * halfMovesPerLine, len(self.moveTexts), halfMovesPerLine):
+            text = ""
+            for j in range(i, min(i + halfMovesPerLine, len(self.moveTexts)), 2):
+                text += str(j // 2 + 1) + ". " + self.moveTexts[j]
+                if j + 1 < len(self.moveTexts):  # make sure black made a move
+                    text += " " + self.moveTexts[j + 1] + " "
+            self.lines.append(self.moveLogFont.render(text, 1, p.Color("White")))
+        if self.followLastMove:
+            self.firstLine = self.getLastFirstLine()
+        self.firstLine = min(self.firstLine, self.getLastFirstLine())
+        self.dirty = True
+
+    def getLastFirstLine(self):
+        return max(0, len(self.lines) - self.visibleLines)
+
+    def scroll(self, lines):
+        """
+        Scrolls by the number of lines, down if positive. Scrolling to the end follows the new moves again.
+        """
+        firstLine = max(0, min(self.firstLine + lines, self.getLastFirstLine()))
+        self.followLastMove = firstLine == self.getLastFirstLine()
+        if firstLine != self.firstLine:
+            self.firstLine = firstLine
+            self.dirty = True
+
+    def draw(self, screen):
+        p.draw.rect(screen, p.Color("black"), self.rect)
+        paddingY = self.padding
+        for line in self.lines[self.firstLine:self.firstLine + self.visibleLines]:
+            screen.blit(line, self.rect.move(self.padding, paddingY))
+            paddingY += self.lineHeight
+        self.dirty = False
+        return self.rect
 
 
 """
@@ -335,30 +570,44 @@ Animating the move
 """
 
 
-def animateMove(move, screen, board, clock):
-    global colors
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    framesPerSquare = 4  # frames to move one square
-    frameCount = (abs(dR) + abs(dC)) * framesPerSquare
-    for frame in range(frameCount + 1):
-        r, c = (move.startRow + dR * frame / frameCount, move.startCol + dC * frame / frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
+class MoveAnimation:
+    def __init__(self, move, board, boardSurface, startTime):
+        """
+        Slides the moved piece from its start to its end square, 4 frames of 1/60 s per square.
+        The board without the moved piece is rendered once; a frame blits the part of it the piece travels over
+        and the piece on top, so the main loop keeps handling events while the move is shown.
+        """
+        self.move = move
+        self.startTime = startTime
+        squareCount = abs(move.endRow - move.startRow) + abs(move.endCol - move.startCol)
+        self.duration = squareCount * ANIMATION_FRAMES_PER_SQUARE * 1000 / ANIMATION_FPS  # milliseconds
+        self.rect = p.Rect(min(move.startCol, move.endCol) * SQUARE_SIZE, min(move.startRow, move.endRow) * SQUARE_SIZE,
+                           (abs(move.endCol - move.startCol) + 1) * SQUARE_SIZE,
+                           (abs(move.endRow - move.startRow) + 1) * SQUARE_SIZE)
+        self.snapshot = boardSurface.copy()
+        drawPieces(self.snapshot, board)
         # erase the piece moved from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
         endSquare = p.Rect(move.endCol * SQUARE_SIZE, move.endRow * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-        p.draw.rect(screen, color, endSquare)
+        self.snapshot.blit(boardSurface, endSquare, endSquare)
         # draw captured piece in rectangle
         if move.pieceCaptured != "--":
             if move.isEnPassantMove:
                 enPassantRow = (move.endRow + 1) if move.pieceCaptured[0] == "b" else (move.endRow - 1)
                 endSquare = p.Rect(move.endCol * SQUARE_SIZE, enPassantRow * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
+                self.snapshot.blit(boardSurface, endSquare, endSquare)
+            self.snapshot.blit(IMAGES[move.pieceCaptured], endSquare)
+
+    def isFinished(self, now):
+        return now - self.startTime >= self.duration
+
+    def draw(self, screen, now):
+        progress = min(1.0, (now - self.startTime) / self.duration) if self.duration > 0 else 1.0
+        r = self.move.startRow + (self.move.endRow - self.move.startRow) * progress
+        c = self.move.startCol + (self.move.endCol - self.move.startCol) * progress
+        screen.blit(self.snapshot, self.rect, self.rect)
         # draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(c * SQUARE_SIZE, r * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-        p.display.flip()
-        clock.tick(60)
+        screen.blit(IMAGES[self.move.pieceMoved], p.Rect(c * SQUARE_SIZE, r * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+        return self.rect
 
 
 def drawEndGameText(screen, text):
@@ -0,0 +1,75 @@
+"""
+This file is responsible for running the engine work off the pygame main thread.
+Jobs go through a queue to a background thread, the results come back to the main loop as ENGINE_RESULT_EVENT.
+"""
+import queue
+import threading
+
+import pygame as p
+
+import ChessEngine
+import SearchEngine
+
+ENGINE_RESULT_EVENT = p.USEREVENT + 1
+
+
+class EngineWorker(threading.Thread):
+    def __init__(self, timeLimit=5.0):
+        super().__init__(daemon=True)
+        self.timeLimit = timeLimit
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.generation = 0  # jobs of an older generation are cancelled
+        self.lastJobId = 0
+        self.searcher = None
+        self.running = True
+
+    def submitSearch(self, gs):
+        """
+        Queues a search of the current position and returns the id of the job.
+        The worker searches its own copy of the position, so gs can be changed meanwhile.
+        """
+        with self.lock:
+            self.lastJobId += 1
+            self.jobs.put((self.lastJobId, self.generation, gs.getSnapshot(), gs.useBitboards, gs.zobristKey))
+            return self.lastJobId
+
+    def cancel(self):
+        """
+        Drops the queued jobs and stops the running search, its result is never posted.
+        """
+        with self.lock:
+            self.generation += 1
+            while not self.jobs.empty():
+                try:
+                    self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+            if self.searcher is not None:
+                self.searcher.stop()
+
+    def shutdown(self):
+        self.running = False
+        self.cancel()
+        self.jobs.put(None)
+        self.join(timeout=1.0)
+
+    def run(self):
+        while self.running:
+            job = self.jobs.get()
+            if job is None:
+                break
+            jobId, generation, snapshot, useBitboards, positionKey = job
+            with self.lock:
+                if generation != self.generation:
+                    continue
+                self.searcher = SearchEngine.Searcher(self.timeLimit)
+            gs = ChessEngine.GameState.fromSnapshot(snapshot, useBitboards)
+            result = self.searcher.search(gs)
+            with self.lock:
+                self.searcher = None
+                if generation != self.generation:
+                    continue
+            # positionKey lets the main loop check that the board hasn't changed since the job was submitted
+            p.event.post(p.event.Event(ENGINE_RESULT_EVENT, jobId=jobId, positionKey=positionKey,
+                                       moveID=result.bestMove.moveID if result.bestMove else None, result=result))
@@ -0,0 +1,133 @@
+"""
+This file is responsible for running perft and the search on several processes.
+The root moves are split across a process pool; every worker gets the compact GameState snapshot and the moveIDs
+of its root moves instead of a pickled GameState with its move log.
+
+Usage: python ParallelEngine.py [--workers N] [--depth N] [--time SECONDS] [--bitboards]
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+import ChessEngine
+import PerftBenchmark
+import SearchEngine
+
+
+def getWorkerCount(workers=None):
+    return workers if workers else os.cpu_count() or 1
+
+
+def findMoves(gs, moveIDs):
+    moves = {move.moveID: move for move in gs.getValidMoves()}
+    return [moves[moveID] for moveID in moveIDs]
+
+
+def perftWorker(job):
+    snapshot, useBitboards, moveID, depth = job
+    gs = ChessEngine.GameState.fromSnapshot(snapshot, useBitboards)
+    move = findMoves(gs, [moveID])[0]
+    gs.makeMove(move)
+    nodes = gs.perft(depth - 1)
+    return move.getFullChessNotation(), nodes
+
+
+def searchWorker(job):
+    snapshot, useBitboards, moveIDs, timeLimit, maxDepth = job
+    gs = ChessEngine.GameState.fromSnapshot(snapshot, useBitboards)
+    searcher = SearchEngine.Searcher(timeLimit, maxDepth, stopEarly=False)  # deepens until the time is up
+    result = searcher.search(gs, findMoves(gs, moveIDs))
+    # every finished iteration, so that the results of the workers can be compared at the same depth
+    iterations = [(iteration.depth, iteration.score, iteration.bestMove.moveID) for iteration in searcher.iterations]
+    return iterations, result.nodes
+
+
+def parallelPerftDivide(gs, depth, workers=None):
+    """
+    perftDivide with one job per root move spread over the process pool.
+    """
+    snapshot = gs.getSnapshot()
+    jobs = [(snapshot, gs.useBitboards, move.moveID, depth) for move in gs.getValidMoves()]
+    with multiprocessing.Pool(getWorkerCount(workers)) as pool:
+        return dict(pool.imap_unordered(perftWorker, jobs))
+
+
+def parallelPerft(gs, depth, workers=None):
+    if depth <= 1:
+        return gs.perft(depth)
+    return sum(parallelPerftDivide(gs, depth, workers).values())
+
+
+def parallelSearch(gs, timeLimit=5.0, maxDepth=SearchEngine.MAX_PLY, workers=None):
+    """
+    Root-parallel search: the root moves are dealt out to the workers, each searches its share with its own
+    iterative deepening until the time is up, and the best move is taken at the deepest depth every worker has
+    finished.
+    Returns a SearchEngine.SearchResult.
+    """
+    startTime = time.perf_counter()
+    moves = gs.getValidMoves()
+    if len(moves) == 0:
+        return SearchEngine.Searcher(timeLimit, maxDepth).search(gs)
+    workers = min(getWorkerCount(workers), len(moves))
+    snapshot = gs.getSnapshot()
+    jobs = [(snapshot, gs.useBitboards, [move.moveID for move in moves[i::workers]], timeLimit, maxDepth)
+            for i in range(workers)]
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.map(searchWorker, jobs)
+
+    nodes = sum(workerNodes for _, workerNodes in results)
+    depth = min(iterations[-1][0] if iterations else 0 for iterations, _ in results)
+    bestScore = -SearchEngine.INFINITY
+    bestMoveID = moves[0].moveID
+    for iterations, _ in results:
+        for iterationDepth, score, moveID in iterations:
+            if iterationDepth == depth and score > bestScore:
+                bestScore = score
+                bestMoveID = moveID
+    bestMove = findMoves(gs, [bestMoveID])[0]
+    return SearchEngine.SearchResult(bestMove, bestScore, depth, nodes, time.perf_counter() - startTime, [bestMove])
+
+
+def compareSpeed(depth, timeLimit, workers, useBitboards):
+    """
+    Runs perft and the search single-process and on the pool and prints the speedups.
+    """
+    workers = getWorkerCount(workers)
+    print("Workers: " + str(workers))
+    for name, fen, expectedCounts in PerftBenchmark.REFERENCE_POSITIONS:
+        gs = ChessEngine.GameState.fromFen(fen, useBitboards)
+        perftDepth = min(depth, len(expectedCounts))
+        start = time.perf_counter()
+        nodes = gs.perft(perftDepth)
+        singleTime = time.perf_counter() - start
+        start = time.perf_counter()
+        parallelNodes = parallelPerft(gs, perftDepth, workers)
+        parallelTime = time.perf_counter() - start
+        print("%-32s perft %d: %9d nodes, single %6.2fs, parallel %6.2fs, speedup %.2fx%s"
+              % (name, perftDepth, nodes, singleTime, parallelTime, singleTime / parallelTime,
+                 "" if nodes == parallelNodes else ", MISMATCH: " + str(parallelNodes)))
+
+    for name, fen, _ in PerftBenchmark.REFERENCE_POSITIONS:
+        gs = ChessEngine.GameState.fromFen(fen, useBitboards)
+        single = SearchEngine.Searcher(timeLimit).search(gs)
+        parallel = parallelSearch(gs, timeLimit, workers=workers)
+        print("%-32s search: single depth %d %.0f nps (%s), parallel depth %d %.0f nps (%s), nps speedup %.2fx"
+              % (name, single.depth, single.getNodesPerSecond(), single.bestMove.getFullChessNotation(),
+                 parallel.depth, parallel.getNodesPerSecond(), parallel.bestMove.getFullChessNotation(),
+                 parallel.getNodesPerSecond() / single.getNodesPerSecond()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multiprocess perft and search of ChessEngine.GameState")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes, all cores by default")
+    parser.add_argument("--depth", type=int, default=3, help="perft depth of every reference position")
+    parser.add_argument("--time", type=float, default=5.0, help="time budget of every search in seconds")
+    parser.add_argument("--bitboards", action="store_true", help="generate the moves from the bitboards")
+    args = parser.parse_args()
+    compareSpeed(args.depth, args.time, args.workers, args.bitboards)
+
+
+if __name__ == "__main__":
+    main()
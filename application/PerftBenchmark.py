@@ -0,0 +1,160 @@
+"""
+This file is responsible for benchmarking and checking the move generator with perft.
+It runs the standard reference positions, reports nodes/sec and every node count that doesn't match the reference.
+
+It also checks that FEN export and import and the short notation of the moves round-trip on the reference positions
+and along random games.
+
+Usage: python PerftBenchmark.py [--depth N] [--bitboards] [--divide FEN DEPTH] [--fen GAMES]
+"""
+import argparse
+import random
+import time
+
+import ChessEngine
+
+# name, FEN, node counts for depth 1, 2, 3, ...
+REFERENCE_POSITIONS = [
+    ("start position", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862]),
+    ("en passant and pins", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238]),
+    ("castling and promotion", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467]),
+    ("promotion to the castling rook", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890]),
+]
+
+
+def runBenchmark(maxDepth, useBitboards):
+    totalNodes = 0
+    totalTime = 0
+    mismatches = []
+    for name, fen, expectedCounts in REFERENCE_POSITIONS:
+        for depth in range(1, min(maxDepth, len(expectedCounts)) + 1):
+            gs = ChessEngine.GameState.fromFen(fen, useBitboards)
+            start = time.perf_counter()
+            nodes = gs.perft(depth)
+            elapsed = time.perf_counter() - start
+            totalNodes += nodes
+            totalTime += elapsed
+            status = "ok" if nodes == expectedCounts[depth - 1] else "MISMATCH, expected " + \
+                str(expectedCounts[depth - 1])
+            if nodes != expectedCounts[depth - 1]:
+                mismatches.append((name, depth, nodes, expectedCounts[depth - 1]))
+            print("%-32s depth %d: %9d nodes %8.2fs %9.0f nodes/sec  %s"
+                  % (name, depth, nodes, elapsed, nodes / elapsed if elapsed > 0 else 0, status))
+    print("Total: %d nodes in %.2fs, %.0f nodes/sec" % (totalNodes, totalTime, totalNodes / totalTime))
+    if mismatches:
+        print("%d mismatches:" % len(mismatches))
+        for name, depth, nodes, expected in mismatches:
+            print("  %s depth %d: %d instead of %d" % (name, depth, nodes, expected))
+    else:
+        print("All node counts match.")
+    return mismatches
+
+
+# FEN strings that must come back unchanged from fromFen(fen).toFen()
+FEN_ROUND_TRIPS = [fen for _, fen, _ in REFERENCE_POSITIONS] + [
+    "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1",
+    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    "r3k3/8/8/8/8/8/8/4K2R b Kq - 37 64",
+    "8/8/8/8/8/8/8/K6k w - - 99 150",
+]
+
+
+def checkPosition(gs):
+    """
+    Loads the FEN of gs into a new GameState and returns the list of the differences between the two.
+    """
+    fen = gs.toFen()
+    loaded = ChessEngine.GameState.fromFen(fen, gs.useBitboards)
+    differences = []
+    if loaded.toFen() != fen:
+        differences.append("FEN " + loaded.toFen())
+    if loaded.board != gs.board:
+        differences.append("board")
+    if loaded.zobristKey != gs.zobristKey:
+        differences.append("Zobrist key")
+    if (loaded.whiteKingLocation, loaded.blackKingLocation) != (gs.whiteKingLocation, gs.blackKingLocation):
+        differences.append("king locations")
+    if set(loaded.getValidMoves()) != set(gs.getValidMoves()):
+        differences.append("valid moves")
+    for move in loaded.getValidMoves():  # the short notation must lead back to the same move
+        san = loaded.getShortNotation(move)
+        if loaded.getMoveFromSan(san) != move:
+            differences.append("SAN " + san + " of " + move.getFullChessNotation())
+    return [fen + ": " + difference for difference in differences]
+
+
+def runFenChecks(games, useBitboards, seed=2022):
+    """
+    Round-trips the fixed FEN strings and every position of random games, then measures the parsing speed.
+    """
+    failures = []
+    for fen in FEN_ROUND_TRIPS:
+        gs = ChessEngine.GameState.fromFen(fen, useBitboards)
+        if gs.toFen() != fen:
+            failures.append(fen + ": exported as " + gs.toFen())
+        failures += checkPosition(gs)
+    generator = random.Random(seed)
+    positions = 0
+    for _ in range(games):
+        gs = ChessEngine.GameState(useBitboards=useBitboards)
+        for _ in range(generator.randint(1, 120)):
+            moves = gs.getValidMoves()
+            if len(moves) == 0:
+                break
+            gs.makeMove(generator.choice(moves))
+            failures += checkPosition(gs)
+            positions += 1
+        while gs.moveLog:  # the counters must come back with undoMove
+            gs.undoMove()
+        if gs.toFen() != FEN_ROUND_TRIPS[0]:
+            failures.append("undo of a random game: " + gs.toFen())
+    print("FEN round trip: %d fixed positions, %d positions of %d random games, %d failures"
+          % (len(FEN_ROUND_TRIPS), positions, games, len(failures)))
+    for failure in failures:
+        print("  " + failure)
+
+    count = 20000
+    gs = ChessEngine.GameState(useBitboards=useBitboards)
+    start = time.perf_counter()
+    for i in range(count):
+        ChessEngine.parseFen(FEN_ROUND_TRIPS[i % len(FEN_ROUND_TRIPS)])
+    parseTime = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(count):
+        gs.loadFen(FEN_ROUND_TRIPS[i % len(FEN_ROUND_TRIPS)])
+    loadTime = time.perf_counter() - start
+    print("parseFen: %.0f positions/sec, loadFen: %.0f positions/sec" % (count / parseTime, count / loadTime))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft benchmark of ChessEngine.GameState")
+    parser.add_argument("--depth", type=int, default=3, help="maximal depth of every reference position")
+    parser.add_argument("--bitboards", action="store_true", help="generate the moves from the bitboards")
+    parser.add_argument("--divide", nargs=2, metavar=("FEN", "DEPTH"), help="print the perft divide of a position")
+    parser.add_argument("--fen", type=int, metavar="GAMES", help="check the FEN round trip along random games")
+    args = parser.parse_args()
+    if args.fen is not None:
+        failures = runFenChecks(args.fen, args.bitboards)
+        raise SystemExit(1 if failures else 0)
+    elif args.divide:
+        gs = ChessEngine.GameState.fromFen(args.divide[0], args.bitboards)
+        divide = gs.perftDivide(int(args.divide[1]))
+        for move in sorted(divide):
+            print(move + ": " + str(divide[move]))
+        print("Total: " + str(sum(divide.values())))
+    else:
+        mismatches = runBenchmark(args.depth, args.bitboards)
+        raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
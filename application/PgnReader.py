@@ -0,0 +1,254 @@
+"""
+This file is responsible for reading PGN game databases and replaying them on GameState.
+Games are read one by one from the stream, so the memory use doesn't depend on the size of the file.
+Replaying checks every SAN move and its check/mate suffix against the move generator and collects opening statistics.
+
+Usage: python PgnReader.py FILE [FILE ...] [--workers N] [--plies N] [--top N] [--bitboards]
+"""
+import argparse
+import multiprocessing
+import time
+
+import ChessEngine
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+RESULTS = ("1-0", "1/2-1/2", "0-1", "*")
+
+
+class PgnGame:
+    def __init__(self, headers, moves, result):
+        self.headers = headers  # tag name -> value
+        self.moves = moves  # SAN moves of the main line
+        self.result = result
+
+    def getStartFen(self):
+        return self.headers.get("FEN", START_FEN)
+
+    def getName(self):
+        return self.headers.get("White", "?") + " - " + self.headers.get("Black", "?") + \
+            " (" + self.headers.get("Event", "?") + ", " + self.headers.get("Date", "?") + ")"
+
+
+def splitGames(stream):
+    """
+    Yields the text of every game of a PGN stream: its tag lines and its movetext.
+    """
+    lines = []
+    inMoveText = False
+    for line in stream:
+        line = line.strip()
+        if line.startswith("[") and inMoveText:  # the tags of the next game
+            yield "\n".join(lines)
+            lines = []
+            inMoveText = False
+        if line and not line.startswith("[") and not line.startswith("%"):
+            inMoveText = True
+        lines.append(line)
+    if inMoveText:
+        yield "\n".join(lines)
+
+
+def parseMoveText(moveText):
+    """
+    Returns the SAN moves of the main line and the result. Comments, variations, NAGs and move numbers are skipped.
+    """
+    moves = []
+    result = "*"
+    depth = 0  # nesting of the variations
+    i = 0
+    length = len(moveText)
+    while i < length:
+        char = moveText[i]
+        if char == "{":
+            end = moveText.find("}", i)
+            i = length if end == -1 else end + 1
+        elif char == ";":
+            end = moveText.find("\n", i)
+            i = length if end == -1 else end + 1
+        elif char == "(":
+            depth += 1
+            i += 1
+        elif char == ")":
+            depth -= 1
+            i += 1
+        elif char.isspace():
+            i += 1
+        else:
+            end = i
+            while end < length and not moveText[end].isspace() and moveText[end] not in "{;()":
+                end += 1
+            token = moveText[i:end]
+            i = end
+            if depth > 0 or token[0] == "$":
+                continue
+            if token in RESULTS:
+                result = token
+                continue
+            token = token.lstrip("0123456789.")  # "12.e4" or "12..." before the move
+            if token:
+                moves.append(token)
+    return moves, result
+
+
+def parseGame(text):
+    headers = {}
+    moveTextLines = []
+    for line in text.split("\n"):
+        if line.startswith("["):
+            name, _, value = line[1:].rstrip("]").partition(" ")
+            headers[name] = value.strip().strip('"')
+        elif not line.startswith("%"):
+            moveTextLines.append(line)
+    moves, result = parseMoveText("\n".join(moveTextLines))
+    return PgnGame(headers, moves, headers.get("Result", result))
+
+
+def readGames(stream):
+    """
+    Yields a PgnGame for every game of a PGN stream.
+    """
+    for text in splitGames(stream):
+        yield parseGame(text)
+
+
+def replayGame(game, gs=None, useBitboards=False):
+    """
+    Plays the moves of the game and yields (gs, move, san) after each of them, the GameState is the same object
+    every time. Pass gs to reuse one GameState for many games.
+    Raises ValueError on an illegal move or on a check/mate suffix that doesn't fit the position.
+    """
+    if gs is None:
+        gs = ChessEngine.GameState(useBitboards=useBitboards)
+    gs.loadFen(game.getStartFen())
+    for san in game.moves:
+        try:
+            move = gs.getMoveFromSan(san)
+        except ValueError as e:
+            raise ValueError(str(e) + " after " + str(len(gs.moveLog)) + " plies of " + game.getName())
+        gs.makeMove(move)
+        suffixed = san.rstrip("!?")  # "Qxf7#!"
+        if suffixed.endswith("#") != gs.checkmate or (suffixed.endswith("+") and not gs.inCheck):
+            raise ValueError("Wrong check suffix of " + san + " after " + str(len(gs.moveLog)) + " plies of " +
+                             game.getName())
+        yield gs, move, san
+
+
+def replayGames(games, useBitboards=False, features=None):
+    """
+    Replays the games one after another and yields features(game, gs, move, san) after every move,
+    (game, gs.zobristKey, move) if no features function is given. Games with an illegal move are stopped there.
+    """
+    gs = ChessEngine.GameState(useBitboards=useBitboards)
+    for game in games:
+        try:
+            for _, move, san in replayGame(game, gs):
+                yield features(game, gs, move, san) if features else (game, gs.zobristKey, move)
+        except ValueError as e:
+            print("Skipping the rest of the game: " + str(e))
+
+
+class ReplayStats:
+    def __init__(self, openingPlies=8):
+        self.openingPlies = openingPlies
+        self.games = 0
+        self.positions = 0
+        self.errors = []
+        self.openings = {}  # first SAN moves -> [white wins, draws, black wins, unfinished]
+
+    def addGame(self, game, gs):
+        self.games += 1
+        try:
+            for _ in replayGame(game, gs):
+                self.positions += 1
+        except ValueError as e:
+            self.errors.append(str(e))
+            return
+        if "FEN" not in game.headers:
+            opening = " ".join(game.moves[:self.openingPlies])
+            counts = self.openings.setdefault(opening, [0, 0, 0, 0])
+            counts[RESULTS.index(game.result) if game.result in RESULTS else 3] += 1
+
+    def merge(self, other):
+        self.games += other.games
+        self.positions += other.positions
+        self.errors += other.errors
+        for opening, counts in other.openings.items():
+            ownCounts = self.openings.setdefault(opening, [0, 0, 0, 0])
+            for i in range(4):
+                ownCounts[i] += counts[i]
+
+    def getTopOpenings(self, count):
+        return sorted(self.openings.items(), key=lambda item: sum(item[1]), reverse=True)[:count]
+
+
+def replayWorker(job):
+    texts, openingPlies, useBitboards = job
+    stats = ReplayStats(openingPlies)
+    gs = ChessEngine.GameState(useBitboards=useBitboards)
+    for text in texts:
+        stats.addGame(parseGame(text), gs)
+    return stats
+
+
+def iterateBatches(paths, batchSize):
+    batch = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as stream:
+            for text in splitGames(stream):
+                batch.append(text)
+                if len(batch) == batchSize:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+def replayFiles(paths, openingPlies=8, useBitboards=False, workers=1, batchSize=64):
+    """
+    Replays every game of the PGN files and returns the merged ReplayStats.
+    With several workers the games are sent to a process pool in batches; at most two batches per worker are
+    waiting at a time, so big files aren't read into memory ahead of the workers.
+    """
+    stats = ReplayStats(openingPlies)
+    if workers <= 1:
+        gs = ChessEngine.GameState(useBitboards=useBitboards)
+        for batch in iterateBatches(paths, batchSize):
+            for text in batch:
+                stats.addGame(parseGame(text), gs)
+        return stats
+    with multiprocessing.Pool(workers) as pool:
+        pending = []
+        for batch in iterateBatches(paths, batchSize):
+            pending.append(pool.apply_async(replayWorker, ((batch, openingPlies, useBitboards),)))
+            if len(pending) >= 2 * workers:
+                stats.merge(pending.pop(0).get())
+        for result in pending:
+            stats.merge(result.get())
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay PGN files on ChessEngine.GameState")
+    parser.add_argument("files", nargs="+", help="PGN files")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--plies", type=int, default=8, help="length of the openings in the statistics")
+    parser.add_argument("--top", type=int, default=10, help="number of the most frequent openings printed")
+    parser.add_argument("--bitboards", action="store_true", help="generate the moves from the bitboards")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = replayFiles(args.files, args.plies, args.bitboards, args.workers)
+    elapsed = time.perf_counter() - start
+    print("%d games, %d positions in %.2fs, %.0f positions/sec, %d errors"
+          % (stats.games, stats.positions, elapsed, stats.positions / elapsed if elapsed > 0 else 0,
+             len(stats.errors)))
+    for error in stats.errors:
+        print("  " + error)
+    print("Most frequent openings (white wins / draws / black wins / unfinished):")
+    for opening, counts in stats.getTopOpenings(args.top):
+        print("%6d  %s  %s" % (sum(counts), "/".join(str(count) for count in counts), opening))
+    raise SystemExit(1 if stats.errors else 0)
+
+
+if __name__ == "__main__":
+    main()
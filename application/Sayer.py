@@ -1,7 +1,122 @@
+import hashlib
+import io
+import os
+import queue
+import threading
+import time
+import wave
+from array import array
+
+import pygame as p
+
+CLIP_SILENCE_THRESHOLD = 500  # 16-bit samples below it are trimmed from both ends of a clip
+CLIP_MARGIN_SECONDS = 0.03  # kept around the trimmed clip
+CLIP_GAP_SECONDS = 0.05  # between the clips of one utterance
+
+
+class ClipCache:
+    def __init__(self, directory="./data/tts-cache"):
+        """
+        Audio clips of the phrases rendered by the TTS engine once and kept on disk, one WAV file per phrase,
+        named by the hash of the phrase and the voice settings. Clips are trimmed of their silence, joined into
+        one sound and played through pygame.mixer, so saying a move doesn't wait for the TTS engine.
+        The engine is set by the Sayer on the thread it speaks from.
+        """
+        self.engine = None
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.voiceKey = None  # read from the engine on its own thread, by the first getPath
+        self.clips = {}  # phrase -> (channels, sample width, frame rate, frames), None if it couldn't be rendered
+
+    def getPath(self, text):
+        if self.voiceKey is None:
+            self.voiceKey = str(self.engine.getProperty("voice")) + "|" + str(self.engine.getProperty("rate"))
+        return os.path.join(self.directory, hashlib.sha1((self.voiceKey + "|" + text).encode("utf-8")).hexdigest()
+                            + ".wav")
+
+    def getClip(self, text):
+        """
+        Returns the clip of the phrase, renders it first if it isn't on disk yet. None if it can't be read,
+        the phrase isn't rendered again then. Must be called from the thread the TTS engine runs on.
+        """
+        if text in self.clips:
+            return self.clips[text]
+        path = self.getPath(text)
+        if not os.path.exists(path):
+            self.engine.save_to_file(text, path)
+            self.engine.runAndWait()
+        try:
+            with wave.open(path, "rb") as file:
+                clip = (file.getnchannels(), file.getsampwidth(), file.getframerate(),
+                        file.readframes(file.getnframes()))
+        except (OSError, EOFError, wave.Error):  # not rendered or not a WAV file (some engines write AIFF)
+            self.clips[text] = None
+            return None
+        clip = self.trim(clip)
+        self.clips[text] = clip
+        return clip
+
+    def trim(self, clip):
+        channels, sampleWidth, frameRate, frames = clip
+        if sampleWidth != 2:
+            return clip
+        samples = array("h", frames)
+        loud = [i for i in range(len(samples)) if abs(samples[i]) > CLIP_SILENCE_THRESHOLD]
+        if not loud:
+            return clip
+        margin = int(CLIP_MARGIN_SECONDS * frameRate) * channels
+        start = max(0, loud[0] - margin) // channels * channels
+        end = min(len(samples), loud[-1] + margin + 1) // channels * channels
+        return channels, sampleWidth, frameRate, samples[start:end].tobytes()
+
+    def warmUp(self, texts):
+        for text in texts:
+            self.getClip(text)
+
+    def play(self, texts, isCancelled=lambda: False):
+        """
+        Plays the clips of the phrases one after another and waits for the end, stops early once isCancelled().
+        Returns False if a clip is missing or the clips don't fit together, nothing is played then.
+        """
+        clips = [self.getClip(text) for text in texts]
+        if not clips or None in clips or len({clip[:3] for clip in clips}) != 1:
+            return False
+        channels, sampleWidth, frameRate, _ = clips[0]
+        gap = bytes(int(CLIP_GAP_SECONDS * frameRate) * channels * sampleWidth)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as file:
+            file.setnchannels(channels)
+            file.setsampwidth(sampleWidth)
+            file.setframerate(frameRate)
+            file.writeframes(gap.join(clip[3] for clip in clips))
+        buffer.seek(0)
+        try:
+            if not p.mixer.get_init():
+                p.mixer.init()
+            channel = p.mixer.Sound(file=buffer).play()
+        except p.error:  # no audio device for the mixer
+            return False
+        while channel is not None and channel.get_busy():
+            if isCancelled():
+                channel.stop()
+                break
+            time.sleep(0.005)
+        return True
+
+
 class Sayer:
 
-    def __init__(self, engine, lang):
-        self.engine = engine
+    def __init__(self, createEngine, lang, asynchronous=False, clipCache=None, warmUpPhrases=()):
+        """
+        createEngine makes the TTS engine (pyttsx3.init). Its drivers must be used from the thread they were made on,
+        so with asynchronous set the engine is made and used by a background thread only: say just queues the
+        phrase and returns, the thread speaks the queue, joining the waiting phrases into one utterance, and cancel
+        drops what hasn't been said yet and lets the thread stop the current utterance.
+        With a ClipCache the phrases and the words of the moves are played from pre-rendered clips;
+        the words and warmUpPhrases are rendered at the start (on the background thread if asynchronous).
+        """
+        self.createEngine = createEngine
+        self.engine = None
         self.figuresToText = {}
         self.colsToText = {}
         self.rowsToText = {}
@@ -15,45 +130,151 @@ class Sayer:
         else:
             raise AttributeError("No Sayer language specified. Please specify language")
 
+        self.asynchronous = asynchronous
+        self.clipCache = clipCache
+        self.warmUpPhrases = list(self.figuresToText.values()) + list(self.colsToText.values()) + \
+            list(self.rowsToText.values()) + list(self.castlesToText.values()) + list(warmUpPhrases)
+        self.phrases = queue.Queue()
+        self.lock = threading.Lock()
+        self.generation = 0  # phrases of an older generation are cancelled
+        self.speakingGeneration = 0  # the generation of the utterance being spoken
+        self.speaking = False
+        if asynchronous:
+            self.worker = threading.Thread(target=self.speakQueue, daemon=True)
+            self.worker.start()
+        else:
+            self.startEngine()
+
+    def startEngine(self):
+        """
+        Makes the engine on the calling thread, the only one that uses it afterwards.
+        """
+        self.engine = self.createEngine()
+        self.engine.connect("started-word", self.onWord)
+        if self.clipCache is not None:
+            self.clipCache.engine = self.engine
+            self.clipCache.warmUp(self.warmUpPhrases)
+
     def say(self, stringToSay):
-        self.engine.say(stringToSay)
+        self.sayParts([stringToSay])
+
+    def sayParts(self, parts):
+        """
+        Says the parts one after another as one utterance, every part is a clip of its own.
+        """
+        if self.asynchronous:
+            with self.lock:
+                self.phrases.put((self.generation, parts))
+        else:
+            self.speakingGeneration = self.generation
+            self.speak([parts])
+
+    def speak(self, utterances):
+        if self.clipCache is not None and \
+                self.clipCache.play([part for parts in utterances for part in parts], self.isCancelled):
+            return
+        self.engine.say(". ".join(" ".join(parts).strip() for parts in utterances))
         self.engine.runAndWait()
 
+    def isCancelled(self):
+        return self.speakingGeneration != self.generation
+
+    def onWord(self, name, location, length):
+        """
+        Called by the engine on its own thread while it speaks, stops the utterance once it is cancelled.
+        """
+        if self.isCancelled():
+            self.engine.stop()
+
+    def cancel(self):
+        """
+        Drops the queued phrases. The one being spoken is stopped by the speaking thread, which notices the
+        new generation.
+        """
+        with self.lock:
+            self.generation += 1
+            while not self.phrases.empty():
+                try:
+                    self.phrases.get_nowait()
+                except queue.Empty:
+                    break
+
+    def isSpeaking(self):
+        return self.speaking or not self.phrases.empty()
+
+    def shutdown(self):
+        if self.asynchronous:
+            self.cancel()
+            self.phrases.put(None)
+            self.worker.join(timeout=1.0)
+
+    def speakQueue(self):
+        self.startEngine()  # the engine is made and used on this thread only
+        while True:
+            phrase = self.phrases.get()
+            if phrase is None:
+                break
+            self.speaking = True
+            generation, text = phrase
+            texts = [text]
+            while not self.phrases.empty():  # coalesce the phrases queued meanwhile into one utterance
+                try:
+                    phrase = self.phrases.get_nowait()
+                except queue.Empty:
+                    break
+                if phrase is None:
+                    self.phrases.put(None)
+                    break
+                if phrase[0] != generation:
+                    generation = phrase[0]
+                    texts = []
+                if not texts or texts[-1] != phrase[1]:  # the same phrase twice in a row is said once
+                    texts.append(phrase[1])
+            with self.lock:
+                if generation != self.generation:
+                    self.speaking = False
+                    continue
+                self.speakingGeneration = generation
+            try:
+                self.speak(texts)
+            finally:
+                self.speaking = False
+
     def sayMove(self, notationString):
-        res = ""
+        res = []
         if notationString in self.castlesToText:
             self.say(self.castlesToText[notationString])
             return False
         else:
             error = ""
             if notationString[0] in self.figuresToText:
-                res += self.figuresToText[notationString[0]] + " "
+                res.append(self.figuresToText[notationString[0]])
             else:
                 error += "figure "
             if notationString[1] in self.colsToText:
-                res += self.colsToText[notationString[1]] + " "
+                res.append(self.colsToText[notationString[1]])
             else:
                 error += "startCol "
             if notationString[2] in self.rowsToText:
-                res += self.rowsToText[notationString[2]] + " "
+                res.append(self.rowsToText[notationString[2]])
             else:
                 error += "startRow "
             if notationString[4] in self.colsToText:
-                res += self.colsToText[notationString[4]] + " "
+                res.append(self.colsToText[notationString[4]])
             else:
                 error += "endCol "
             if notationString[5] in self.rowsToText:
-                res += self.rowsToText[notationString[5]] + " "
+                res.append(self.rowsToText[notationString[5]])
             else:
                 error += "endRow "
             if len(notationString) > 6:
                 if notationString[6] in self.figuresToText:
-                    res += self.figuresToText[notationString[6]] + " "
+                    res.append(self.figuresToText[notationString[6]])
                 else:
                     error += "piecePromoting"
             if error != "":
                 print("An unexpected error in Sayer: wrong input: " + error)
                 return True
             else:
-                self.say(res)
+                self.sayParts(res)
                 return False
@@ -0,0 +1,306 @@
+"""
+This file is responsible for choosing moves. It runs an iterative deepening negamax search with alpha-beta pruning
+and quiescence search on top of GameState, playing the moves with makeMove/undoMove.
+"""
+import time
+
+import ChessEngine
+
+PIECE_VALUES = {"p": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_PLY = 64
+
+# piece-square tables from white's point of view, row 0 is the 8th rank (the same orientation as GameState.board)
+PIECE_SQUARE_TABLES = {
+    "p": [[0, 0, 0, 0, 0, 0, 0, 0],
+          [50, 50, 50, 50, 50, 50, 50, 50],
+          [10, 10, 20, 30, 30, 20, 10, 10],
+          [5, 5, 10, 25, 25, 10, 5, 5],
+          [0, 0, 0, 20, 20, 0, 0, 0],
+          [5, -5, -10, 0, 0, -10, -5, 5],
+          [5, 10, 10, -20, -20, 10, 10, 5],
+          [0, 0, 0, 0, 0, 0, 0, 0]],
+    "N": [[-50, -40, -30, -30, -30, -30, -40, -50],
+          [-40, -20, 0, 0, 0, 0, -20, -40],
+          [-30, 0, 10, 15, 15, 10, 0, -30],
+          [-30, 5, 15, 20, 20, 15, 5, -30],
+          [-30, 0, 15, 20, 20, 15, 0, -30],
+          [-30, 5, 10, 15, 15, 10, 5, -30],
+          [-40, -20, 0, 5, 5, 0, -20, -40],
+          [-50, -40, -30, -30, -30, -30, -40, -50]],
+    "B": [[-20, -10, -10, -10, -10, -10, -10, -20],
+          [-10, 0, 0, 0, 0, 0, 0, -10],
+          [-10, 0, 5, 10, 10, 5, 0, -10],
+          [-10, 5, 5, 10, 10, 5, 5, -10],
+          [-10, 0, 10, 10, 10, 10, 0, -10],
+          [-10, 10, 10, 10, 10, 10, 10, -10],
+          [-10, 5, 0, 0, 0, 0, 5, -10],
+          [-20, -10, -10, -10, -10, -10, -10, -20]],
+    "R": [[0, 0, 0, 0, 0, 0, 0, 0],
+          [5, 10, 10, 10, 10, 10, 10, 5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [0, 0, 0, 5, 5, 0, 0, 0]],
+    "Q": [[-20, -10, -10, -5, -5, -10, -10, -20],
+          [-10, 0, 0, 0, 0, 0, 0, -10],
+          [-10, 0, 5, 5, 5, 5, 0, -10],
+          [-5, 0, 5, 5, 5, 5, 0, -5],
+          [0, 0, 5, 5, 5, 5, 0, -5],
+          [-10, 5, 5, 5, 5, 5, 0, -10],
+          [-10, 0, 5, 0, 0, 0, 0, -10],
+          [-20, -10, -10, -5, -5, -10, -10, -20]],
+    "K": [[-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-20, -30, -30, -40, -40, -30, -30, -20],
+          [-10, -20, -20, -20, -20, -20, -20, -10],
+          [20, 20, 0, 0, 0, 0, 20, 20],
+          [20, 30, 10, 0, 0, 10, 30, 20]]
+}
+
+# piece -> row -> col -> value plus position bonus, positive for white and negative for black
+SQUARE_SCORES = {"--": [[0] * 8 for _ in range(8)]}
+for piece, table in PIECE_SQUARE_TABLES.items():
+    SQUARE_SCORES["w" + piece] = [[PIECE_VALUES[piece] + table[r][c] for c in range(8)] for r in range(8)]
+    SQUARE_SCORES["b" + piece] = [[-PIECE_VALUES[piece] - table[7 - r][c] for c in range(8)] for r in range(8)]
+
+
+def evaluate(gs):
+    """
+    Material and piece-square score of the position from the point of view of the side to move.
+    """
+    score = 0
+    for r in range(8):
+        row = gs.board[r]
+        for c in range(8):
+            score += SQUARE_SCORES[row[c]][r][c]
+    return score if gs.whiteToMove else -score
+
+
+class SearchResult:
+    def __init__(self, bestMove, score, depth, nodes, elapsed, principalVariation):
+        self.bestMove = bestMove
+        self.score = score
+        self.depth = depth  # the last fully searched depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.principalVariation = principalVariation
+
+    def getNodesPerSecond(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0
+
+    def __str__(self):
+        return "depth " + str(self.depth) + " score " + str(self.score) + " nodes " + str(self.nodes) + \
+               " time " + "%.2f" % self.elapsed + "s nps " + "%.0f" % self.getNodesPerSecond() + \
+               " pv " + " ".join(move.getFullChessNotation() for move in self.principalVariation)
+
+
+class Searcher:
+    def __init__(self, timeLimit=5.0, maxDepth=MAX_PLY, verbose=False, stopEarly=True):
+        """
+        timeLimit is the budget of one search in seconds, no new iteration starts after half of it is used.
+        With stopEarly the search also ends after an iteration finding a mate or with a single root move;
+        a search of a part of the root moves turns it off to keep deepening like the others.
+        """
+        self.timeLimit = timeLimit
+        self.maxDepth = maxDepth
+        self.verbose = verbose
+        self.stopEarly = stopEarly
+        self.stopRequested = False
+        self.stopped = False
+        self.nodes = 0
+        self.deadline = 0
+        self.killers = []
+        self.history = {}
+        self.principalVariations = []
+        self.rootBestMove = None
+        self.iterations = []  # SearchResult of every finished iteration of the last search
+
+    def stop(self):
+        """
+        Asks the running search to return as soon as possible with the result of the last finished iteration.
+        """
+        self.stopRequested = True
+
+    def search(self, gs, rootMoves=None):
+        """
+        Searches the position and returns a SearchResult. rootMoves restricts the moves searched at the root.
+        The game state is left as it was given.
+        """
+        startTime = time.perf_counter()
+        self.deadline = startTime + self.timeLimit
+        self.stopped = self.stopRequested  # stop() may come before the search has started
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self.history = {}
+        self.principalVariations = [[] for _ in range(MAX_PLY + 2)]  # the best line found from every ply
+        self.iterations = []
+        moves = gs.getValidMoves() if rootMoves is None else list(rootMoves)
+        result = SearchResult(moves[0] if moves else None, 0, 0, 0, 0, [])
+        if len(moves) == 0:
+            result.score = -MATE_SCORE if gs.inCheck else 0
+            self.stopRequested = False
+            return result
+
+        recordShortNotation = gs.recordShortNotation
+        gs.recordShortNotation = False
+        for depth in range(1, self.maxDepth + 1):
+            self.rootBestMove = result.bestMove
+            score, bestMove = self.searchRoot(gs, moves, depth)
+            if self.stopped:
+                break
+            elapsed = time.perf_counter() - startTime
+            result = SearchResult(bestMove, score, depth, self.nodes, elapsed, self.principalVariations[0])
+            self.iterations.append(result)
+            if self.verbose:
+                print(result)
+            if elapsed > self.timeLimit / 2:
+                break
+            if self.stopEarly and (abs(score) >= MATE_SCORE - MAX_PLY or len(moves) == 1):
+                break
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - startTime
+        gs.recordShortNotation = recordShortNotation
+        gs.getValidMoves()  # restore the check and mate flags of the root position
+        self.stopRequested = False
+        return result
+
+    def searchRoot(self, gs, moves, depth):
+        alpha = -INFINITY
+        bestMove = None
+        self.principalVariations[0] = []
+        for move in self.orderMoves(moves, 0):
+            gs.makeMove(move)
+            self.nodes += 1
+            score = -self.negamax(gs, depth - 1, -INFINITY, -alpha, 1)
+            gs.undoMove()
+            if self.stopped:
+                break
+            if score > alpha:
+                alpha = score
+                bestMove = move
+                self.principalVariations[0] = [move] + self.principalVariations[1]
+        return alpha, bestMove
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        if self.nodes & 1023 == 0:
+            self.checkTime()
+        if self.stopped:
+            return 0
+        self.principalVariations[ply] = []
+        if gs.repetitionCounts.get(gs.zobristKey, 0) >= 2:  # a repeated position is a draw from here on
+            return 0
+        moves = gs.getValidMoves()
+        if len(moves) == 0:
+            return -MATE_SCORE + ply if gs.inCheck else 0
+        if gs.inCheck:
+            depth += 1  # check extension
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiescence(gs, alpha, beta, ply)
+
+        bestScore = -INFINITY
+        for move in self.orderMoves(moves, ply):
+            gs.makeMove(move)
+            self.nodes += 1
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if self.stopped:
+                return 0
+            if score > bestScore:
+                bestScore = score
+            if score > alpha:
+                alpha = score
+                self.principalVariations[ply] = [move] + self.principalVariations[ply + 1]
+            if alpha >= beta:
+                if move.pieceCaptured == "--":  # quiet moves causing a cutoff become killers and get history
+                    killers = self.killers[ply]
+                    if killers[0] != move:
+                        killers[1] = killers[0]
+                        killers[0] = move
+                    key = (move.pieceMoved, move.endRow, move.endCol)
+                    self.history[key] = self.history.get(key, 0) + depth * depth
+                break
+        return bestScore
+
+    def quiescence(self, gs, alpha, beta, ply):
+        """
+        Searches only the captures and promotions (every move when in check) until the position is quiet.
+        """
+        if self.nodes & 1023 == 0:
+            self.checkTime()
+        if self.stopped:
+            return 0
+        self.principalVariations[ply] = []
+        if ply >= MAX_PLY:
+            return evaluate(gs)
+        moves = gs.getValidMoves()
+        if len(moves) == 0:
+            return -MATE_SCORE + ply if gs.inCheck else 0
+        if gs.inCheck:
+            bestScore = -INFINITY
+        else:
+            standPat = evaluate(gs)
+            if standPat >= beta:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+            bestScore = standPat
+            moves = [move for move in moves if move.pieceCaptured != "--" or move.isPawnPromotion]
+
+        for move in self.orderMoves(moves, ply):
+            gs.makeMove(move)
+            self.nodes += 1
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if self.stopped:
+                return 0
+            if score > bestScore:
+                bestScore = score
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+        return bestScore
+
+    def orderMoves(self, moves, ply):
+        """
+        Best move of the previous iteration first, then captures by MVV-LVA, promotions, killers and history.
+        """
+        killers = self.killers[ply]
+        scores = {}
+        for move in moves:
+            if ply == 0 and move == self.rootBestMove:
+                score = 1000000
+            elif move.pieceCaptured != "--":
+                score = 100000 + 10 * PIECE_VALUES[move.pieceCaptured[1]] - PIECE_VALUES[move.pieceMoved[1]]
+            elif move.isPawnPromotion:
+                score = 90000 + PIECE_VALUES[move.piecePromoting]
+            elif move == killers[0]:
+                score = 80000
+            elif move == killers[1]:
+                score = 70000
+            else:
+                score = self.history.get((move.pieceMoved, move.endRow, move.endCol), 0)
+            scores[move] = score
+        return sorted(moves, key=scores.__getitem__, reverse=True)
+
+    def checkTime(self):
+        if self.stopRequested or time.perf_counter() > self.deadline:
+            self.stopped = True
+
+
+def main():
+    gs = ChessEngine.GameState(useBitboards=True)
+    searcher = Searcher(timeLimit=10.0, verbose=True)
+    result = searcher.search(gs)
+    print("Best move: " + result.bestMove.getFullChessNotation())
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+This file is responsible for running the speech recognition off the pygame main thread.
+A background thread feeds the microphone audio of a VoskAssistant.AudioSession to the recognizer and posts
+the partial results, the recognized utterances and the errors to the main loop as pygame events.
+"""
+import threading
+
+import pygame as p
+
+VOICE_TEXT_EVENT = p.USEREVENT + 2
+VOICE_PARTIAL_EVENT = p.USEREVENT + 3
+VOICE_ERROR_EVENT = p.USEREVENT + 4
+
+
+class VoiceWorker(threading.Thread):
+    def __init__(self, audioSession, isMuted=None):
+        """
+        While isMuted() is true, for example while the app speaks, the audio is dropped.
+        """
+        super().__init__(daemon=True)
+        self.audioSession = audioSession
+        self.isMuted = isMuted
+        self.lock = threading.Lock()
+        self.generation = 0  # events of an older generation are stale
+        self.listening = False
+        self.resumeRequested = False
+        self.grammar = None  # phrases waiting to be given to the recognizer
+        self.running = True
+
+    def startListening(self):
+        """
+        Starts (or restarts) listening from now on: the audio recorded before, for example the app's own speech,
+        is dropped and the events already posted become stale. Returns the generation of the new events.
+        """
+        with self.lock:
+            self.generation += 1
+            self.resumeRequested = True
+            self.listening = True
+            return self.generation
+
+    def setGrammar(self, phrases):
+        """
+        Restricts the recognition to the phrases from the next chunk of audio on.
+        """
+        with self.lock:
+            self.grammar = phrases
+
+    def stopListening(self):
+        with self.lock:
+            self.generation += 1
+            self.listening = False
+
+    def isCurrent(self, event):
+        return event.generation == self.generation
+
+    def shutdown(self):
+        self.running = False
+        self.stopListening()
+        self.audioSession.close()  # wakes the thread up if it waits for audio
+        self.join(timeout=1.0)
+
+    def post(self, eventType, generation, **attributes):
+        p.event.post(p.event.Event(eventType, generation=generation, **attributes))
+
+    def run(self):
+        lastPartial = ""
+        muted = False
+        while self.running:
+            with self.lock:
+                listening = self.listening
+                generation = self.generation
+                resume = self.resumeRequested
+                self.resumeRequested = False
+                grammar = self.grammar
+                self.grammar = None
+            try:
+                if grammar is not None:
+                    self.audioSession.setGrammar(grammar)
+                if resume:
+                    self.audioSession.resume()  # the recognizer is only touched from this thread
+                    lastPartial = ""
+                data, captureTime = self.audioSession.readChunk(timeout=0.1)
+                if data is None or not listening:
+                    continue
+                if self.isMuted is not None and self.isMuted():
+                    muted = True
+                    continue
+                if muted:  # start from a clean recognizer after the app has stopped speaking
+                    muted = False
+                    self.audioSession.resume()
+                    lastPartial = ""
+                    continue
+                text = self.audioSession.acceptChunk(data, captureTime)
+                if text is not None:
+                    lastPartial = ""
+                    self.post(VOICE_TEXT_EVENT, generation, text=text,
+                              speechEndTime=self.audioSession.speechEndTime)
+                    continue
+                partial = self.audioSession.getPartial()
+                if partial != lastPartial:
+                    lastPartial = partial
+                    self.post(VOICE_PARTIAL_EVENT, generation, text=partial, captureTime=captureTime)
+            except Exception as e:  # report it to the main loop instead of dying silently
+                if not self.running:
+                    break
+                with self.lock:
+                    self.listening = False
+                self.post(VOICE_ERROR_EVENT, generation, error=e)
@@ -1,11 +1,20 @@
 import datetime
 import json
+import statistics
+import threading
+import time
+from collections import deque
+
 import pyaudio
 from vosk import Model, KaldiRecognizer
 from translator import NotationTranslator
 
 import ChessEngine
 
+SAMPLE_RATE = 16000
+CHUNK_FRAMES = 4000  # a quarter of a second
+BUFFER_SECONDS = 10
+
 
 def loadModel(lang):
     modelle = Model('./data/vosk-model-small-ru-0.22')
@@ -18,28 +27,160 @@ def loadModel(lang):
     return modelle
 
 
+class AudioSession:
+    def __init__(self, audioManager, model):
+        """
+        One microphone stream and one recognizer for the whole voice session.
+        The stream callback puts the audio into a ring buffer of BUFFER_SECONDS, so nothing is lost between the
+        utterances; the recognizer is only reset when listening is resumed.
+        The latency from the end of speech to the move being made is measured with reportLatency.
+        """
+        self.recognizer = KaldiRecognizer(model, SAMPLE_RATE)
+        self.recognizer.SetWords(True)  # the word timings give the end of speech
+        self.chunks = deque(maxlen=BUFFER_SECONDS * SAMPLE_RATE // CHUNK_FRAMES)  # (audio, capture time)
+        self.condition = threading.Condition()
+        self.droppedChunks = 0
+        self.samplesFed = 0  # the word timings count from the creation of the recognizer
+        self.speechEndTime = None  # when the words of the last utterance ended
+        self.latencies = []
+        self.decodeTime = 0  # seconds spent in the recognizer
+        self.utterances = 0
+        self.understoodUtterances = 0  # utterances that were a valid move or a command
+        self.closed = False
+        self.stream = audioManager.open(format=pyaudio.paInt16, channels=1, rate=SAMPLE_RATE, input=True,
+                                        frames_per_buffer=CHUNK_FRAMES, stream_callback=self.onAudio)
+        self.stream.start_stream()
+
+    def onAudio(self, data, frameCount, timeInfo, status):
+        with self.condition:
+            if len(self.chunks) == self.chunks.maxlen:
+                self.droppedChunks += 1
+            self.chunks.append((data, time.perf_counter()))
+            self.condition.notify()
+        return None, pyaudio.paContinue
+
+    def resume(self):
+        """
+        Drops the audio recorded while nobody listened and the half-recognized utterance.
+        """
+        with self.condition:
+            self.chunks.clear()
+        self.recognizer.Reset()
+        self.speechEndTime = None
+
+    def readChunk(self, timeout=None):
+        with self.condition:
+            if not self.chunks and not self.closed:
+                self.condition.wait(timeout)
+            return self.chunks.popleft() if self.chunks else (None, None)
+
+    def acceptChunk(self, data, captureTime):
+        """
+        Feeds the recognizer, returns the recognized text when an utterance has ended and None otherwise.
+        """
+        self.samplesFed += len(data) // 2
+        start = time.perf_counter()
+        ended = self.recognizer.AcceptWaveform(data)
+        self.decodeTime += time.perf_counter() - start
+        if not ended:
+            return None
+        answer = json.loads(self.recognizer.Result())
+        if not answer.get("text"):
+            return None
+        self.speechEndTime = captureTime
+        if answer.get("result"):  # the end of the last word is before the silence that ended the utterance
+            self.speechEndTime -= self.samplesFed / SAMPLE_RATE - answer["result"][-1]["end"]
+        return answer["text"]
+
+    def setGrammar(self, phrases):
+        """
+        Restricts the recognizer to the phrases, see NotationTranslator.buildGrammar.
+        """
+        self.recognizer.SetGrammar(json.dumps(phrases, ensure_ascii=False))
+
+    def countUtterance(self, understood):
+        self.utterances += 1
+        if understood:
+            self.understoodUtterances += 1
+
+    def getPartial(self):
+        return json.loads(self.recognizer.PartialResult()).get("partial", "")
+
+    def listen(self):
+        """
+        Yields the text of the next utterance.
+        """
+        while not self.closed:
+            data, captureTime = self.readChunk()
+            if data is None:
+                continue
+            text = self.acceptChunk(data, captureTime)
+            if text is not None:
+                yield text
+                break
+
+    def reportLatency(self, label="move", speechEndTime=None):
+        """
+        Records the time since the end of the last utterance, or since speechEndTime when it's given.
+        """
+        if speechEndTime is None:
+            speechEndTime = self.speechEndTime
+        if speechEndTime is None:
+            return None
+        latency = time.perf_counter() - speechEndTime
+        self.latencies.append(latency)
+        self.speechEndTime = None
+        print("Voice latency (%s): %.0f ms from the end of speech" % (label, latency * 1000))
+        return latency
+
+    def getLatencySummary(self):
+        audioSeconds = self.samplesFed / SAMPLE_RATE
+        summary = "Voice recognition: %d of %d utterances understood, real-time factor %.3f, " \
+                  "%d audio chunks dropped\n" % (self.understoodUtterances, self.utterances,
+                                                 self.decodeTime / audioSeconds if audioSeconds > 0 else 0,
+                                                 self.droppedChunks)
+        if not self.latencies:
+            return summary + "Voice latency: no moves"
+        return summary + "Voice latency over %d moves: median %.0f ms, max %.0f ms" \
+            % (len(self.latencies), statistics.median(self.latencies) * 1000, max(self.latencies) * 1000)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.stream.stop_stream()
+        self.stream.close()
+
+
+def matchSpokenMove(gs, validMoves, text, translator):
+    """
+    Translates the spoken text and returns (notation, the valid move it names or None).
+    """
+    if len(text.split()) < 4 and "рок" not in text:  # too short for a move, even with "едва" for e2
+        return "", None
+    spokenMove = translator.translate(text)
+    res = spokenMove.getNotation()
+    if not spokenMove.isComplete():
+        return res, None
+    move = gs.proposeMoveFromNotation(res)
+    matches = [validMove for validMove in validMoves if validMove == move]
+    return res, matches[0] if len(matches) == 1 else None
+
+
 def loadModelAndStartExperiment():
     model = loadModel('ru-small')
-    rec = KaldiRecognizer(model, 16000)
-    stream = pyaudio.PyAudio().open(format=pyaudio.paInt16, channels=1, rate=16000, input=True, frames_per_buffer=8000)
-    stream.start_stream()
+    audioManager = pyaudio.PyAudio()
+    session = AudioSession(audioManager, model)
 
     print("Выберите файл для записи.\n1 - числа\n2 - фигуры\n3 - буквы\n4 - комбинация строк и столбцов\n5 - ходы")
     mode = input()
-    startExperiment(mode, stream, rec)
-
-
-def listen(stream, rec):
-    while True:
-        data = stream.read(4000, exception_on_overflow=False)
-        if rec.AcceptWaveform(data) and len(data) > 0:
-            answer = json.loads(rec.Result())
-            if answer['text']:
-                yield answer['text']
-                break
+    session.resume()
+    startExperiment(mode, session)
+    session.close()
+    audioManager.terminate()
 
 
-def startExperiment(mode, stream, rec):
+def startExperiment(mode, session):
     if mode == str(1):
         print("Выбран режим записи в файл с числами.")
         file = open('../rows.txt', 'a')
@@ -67,13 +208,13 @@ def startExperiment(mode, stream, rec):
     now = datetime.datetime.now()
     dateNow = now.strftime("%d-%m-%Y %H:%M")
     file.write("Время опыта: " + dateNow + "\n")
-    for text in listen(stream, rec):
+    translator = NotationTranslator.NotationTranslator()
+    for text in session.listen():
         print("Распознано: " + str(text))
         file.write("Распознано: " + str(text) + "\n")
         if "состо" in text:
             print("Ответ: Я готов")
         elif mode == str(5) and "стоп" not in str(text):
-            translator = NotationTranslator.NotationTranslator()
             res = translator.reformatSpeech(str(text))
             gs = ChessEngine.GameState()
             res1 = gs.proposeMoveFromNotation(res).getFullChessNotation()
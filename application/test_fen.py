@@ -0,0 +1,63 @@
+import pytest
+
+import ChessEngine
+import PerftBenchmark
+
+
+@pytest.mark.parametrize("useBitboards", [False, True])
+@pytest.mark.parametrize("fen", PerftBenchmark.FEN_ROUND_TRIPS)
+def testFenRoundTrip(fen, useBitboards):
+    gs = ChessEngine.GameState.fromFen(fen, useBitboards)
+    assert gs.toFen() == fen
+    assert PerftBenchmark.checkPosition(gs) == []
+
+
+def testRandomGamesRoundTrip():
+    assert PerftBenchmark.runFenChecks(5, False, seed=1) == []
+
+
+def testMoveCountersSurviveUndo():
+    gs = ChessEngine.GameState.fromFen("r3k3/8/8/8/8/8/8/4K2R b Kq - 37 64")
+    fens = [gs.toFen()]
+    for san in ["Ra1+", "Kf2", "Rxh1", "Kg2"]:
+        gs.makeMove(gs.getMoveFromSan(san))
+        fens.append(gs.toFen())
+    assert [fen.split(" ", 4)[4] for fen in fens] == ["37 64", "38 65", "39 65", "0 66", "1 66"]
+    while len(fens) > 1:
+        fens.pop()
+        gs.undoMove()
+        assert gs.toFen() == fens[-1]
+
+
+@pytest.mark.parametrize("fen", [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQxq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq z3 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e4 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBN w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNX w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - x 1",
+    "4k3/8/8/8/8/8/8/6K1 w K - 0 1",
+    "4k3/8/8/8/8/8/8/7K w K - 0 1",
+    "r3k3/8/8/8/8/8/8/4K2R w Kk - 0 1",
+    "4k3/8/8/8/8/8/8/4K2r w K - 0 1",
+    "8/8/8/8/8/8/8/8 w - - 0 1",
+    "4k3/8/8/8/8/8/8/8 w - - 0 1",
+    "4k3/8/8/8/8/8/8/K3K3 w - - 0 1",
+    "4k3/8/8/8/8/8/3P4/4K3 w - e3 0 1",
+    "4k3/8/8/4p3/8/8/8/4K3 b - e6 0 1",
+    "4k3/8/8/8/8/8/8/4K3 w - e6 0 1",
+    "4k3/4p3/8/4p3/8/8/8/4K3 w - e6 0 1",
+])
+def testIncorrectFen(fen):
+    with pytest.raises(ValueError):
+        ChessEngine.parseFen(fen)
+
+
+@pytest.mark.parametrize("useBitboards", [False, True])
+def testCastlingAndEnPassantFields(useBitboards):
+    gs = ChessEngine.GameState.fromFen("r3k2r/8/8/3pP3/8/8/8/R3K2R w KQkq d6 0 1", useBitboards)
+    moves = [gs.getShortNotation(move) for move in gs.getValidMoves()]
+    assert "O-O" in moves and "O-O-O" in moves and "exd6" in moves
@@ -0,0 +1,59 @@
+import pytest
+
+import ChessEngine
+from translator import NotationTranslator
+
+translator = NotationTranslator.NotationTranslator()
+
+
+@pytest.mark.parametrize("text, notation", [
+    ("конь же один эф три", "Ng1-f3"),
+    ("пешка едва е четыре", "pe2-e4"),
+    ("пешка е семь е восемь ферзь", "pe7-e8Q"),
+    ("рокировка", "O-O"),
+    ("длинная рокировка", "O-O-O"),
+    ("ферзя дэ один аш пять", "Qd1-h5"),
+])
+def testTranslate(text, notation):
+    spokenMove = translator.translate(text)
+    assert spokenMove.isComplete()
+    assert spokenMove.getNotation() == notation
+
+
+def testTranslateIncompleteMove():
+    assert not translator.translate("слон").isComplete()
+
+
+def resolve(fen, text):
+    gs = ChessEngine.GameState.fromFen(fen)
+    move, _ = translator.resolveMove(text, gs.getValidMoves())
+    return gs.getShortNotation(move) if move is not None else None
+
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+CASTLING_FEN = "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1"
+PROMOTION_FEN = "8/P6k/8/8/8/8/8/K7 w - - 0 1"
+
+
+@pytest.mark.parametrize("fen, text, san", [
+    (START_FEN, "конь эф три", "Nf3"),  # the start square is left out
+    (START_FEN, "е четыре", "e4"),
+    (START_FEN, "кон эф три", "Nf3"),  # a near miss of a word
+    (START_FEN, "конь жэ один эф три", "Nf3"),
+    ("rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 2", "пешка е четыре дэ пять", "exd5"),
+    (CASTLING_FEN, "рокировка", "O-O"),
+    (CASTLING_FEN, "длинная рокировка", "O-O-O"),
+    (PROMOTION_FEN, "пешка а семь а восемь ферзь", "a8=Q"),
+    (PROMOTION_FEN, "а восемь конь", "a8=N"),
+])
+def testResolveMove(fen, text, san):
+    assert resolve(fen, text) == san
+
+
+@pytest.mark.parametrize("fen, text", [
+    (START_FEN, "слон це четыре"),  # no bishop can move
+    (START_FEN, "ко нь жэ один эф три"),  # too far from every move
+    (PROMOTION_FEN, "пешка а семь а восемь"),  # the promotion piece isn't said
+])
+def testResolveMoveRejectsUnclearText(fen, text):
+    assert resolve(fen, text) is None
@@ -0,0 +1,15 @@
+import ChessEngine
+import ParallelEngine
+
+
+def testParallelSearchWithAWorkerPerRootMove():
+    gs = ChessEngine.GameState()
+    result = ParallelEngine.parallelSearch(gs, timeLimit=1.0, workers=len(gs.getValidMoves()))
+    assert result.depth > 1
+    assert result.bestMove in gs.getValidMoves()
+
+
+def testParallelSearchWithMoreWorkersThanRootMoves():
+    gs = ChessEngine.GameState.fromFen("8/8/8/4k3/8/8/4P3/4K3 w - - 0 1")
+    result = ParallelEngine.parallelSearch(gs, timeLimit=1.0, workers=2 * len(gs.getValidMoves()))
+    assert result.depth > 1
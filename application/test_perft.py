@@ -0,0 +1,16 @@
+import pytest
+
+import ChessEngine
+import PerftBenchmark
+
+PERFT_DEPTH = 3  # the deeper reference counts are left to PerftBenchmark.py
+
+
+@pytest.mark.parametrize("useBitboards", [False, True])
+@pytest.mark.parametrize("name, fen, expectedCounts", PerftBenchmark.REFERENCE_POSITIONS,
+                         ids=[name for name, _, _ in PerftBenchmark.REFERENCE_POSITIONS])
+def testPerftMatchesReference(name, fen, expectedCounts, useBitboards):
+    gs = ChessEngine.GameState.fromFen(fen, useBitboards)
+    for depth in range(1, min(PERFT_DEPTH, len(expectedCounts)) + 1):
+        assert gs.perft(depth) == expectedCounts[depth - 1], "%s depth %d" % (name, depth)
+    assert gs.toFen() == fen
@@ -0,0 +1,42 @@
+import io
+
+import PgnReader
+
+ANNOTATED_GAME = """[Event "Annotated"]
+[White "White"]
+[Black "Black"]
+[Result "1-0"]
+
+1. e4! e5 $1 {the open game} 2. Bc4 (2. Nf3 Nc6 (2... d6) 3. Bb5) 2... Nc6?! ; the knight
+3. Qh5 Nf6?? $4 4. Qxf7#! 1-0
+
+[Event "Second"]
+[Result "*"]
+
+1. d4 d5 2. c4 *
+"""
+
+
+def testReplayAnnotatedGame():
+    games = list(PgnReader.readGames(io.StringIO(ANNOTATED_GAME)))
+    assert [game.headers["Event"] for game in games] == ["Annotated", "Second"]
+    game = games[0]
+    assert game.moves == ["e4!", "e5", "Bc4", "Nc6?!", "Qh5", "Nf6??", "Qxf7#!"]
+    assert game.result == "1-0"
+    replayed = [san for _, _, san in PgnReader.replayGame(game)]
+    assert replayed == game.moves
+    stats = PgnReader.ReplayStats()
+    for game in games:
+        stats.addGame(game, None)
+    assert stats.errors == []
+    assert stats.positions == 10
+
+
+def testWrongCheckSuffix():
+    game = PgnReader.parseGame("1. e4+ e5 *")
+    try:
+        list(PgnReader.replayGame(game))
+    except ValueError as e:
+        assert "Wrong check suffix" in str(e)
+    else:
+        assert False, "e4+ isn't a check"
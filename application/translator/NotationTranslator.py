@@ -1,3 +1,118 @@
+"""
+This file is responsible for translating the recognized Russian speech into the chess notation.
+The words are matched in one pass by an automaton compiled from the dictionaries of the translator and the result is
+a SpokenMove; reformatSpeech gives it as the notation string the rest of the app uses ("Ne2-e4", "O-O").
+"""
+FIGURE = "figure"
+COL = "col"
+ROW = "row"
+SQUARE = "square"  # a word heard instead of a whole square, "едва" for e2
+CASTLE = "castle"
+LONG = "long"
+EXACT_SCORE = 1.0  # the word is in the dictionary
+STEM_SCORE = 0.5  # only a part of the word is recognized, "ферзя" for "ферзь"
+MAX_CACHED_WORDS = 10000
+MAX_RESOLVE_COST = 1.0  # about one word misheard, missing or extra
+MIN_RESOLVE_MARGIN = 0.5  # the resolved move must be that much better than the next one
+MISMATCH_COST = 2.0  # a dictionary word for another figure or square is never forgiven
+
+
+def editDistance(first, second):
+    """
+    Levenshtein distance of two strings.
+    """
+    previous = list(range(len(second) + 1))
+    for i, firstChar in enumerate(first, 1):
+        current = [i]
+        for j, secondChar in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (firstChar != secondChar)))
+        previous = current
+    return previous[-1]
+
+
+class PatternAutomaton:
+    def __init__(self, patterns):
+        """
+        Aho-Corasick automaton over the patterns, a dict pattern -> payload. findAll goes over a text once and
+        finds every occurrence of every pattern.
+        """
+        self.transitions = [{}]
+        self.failures = [0]
+        self.outputs = [[]]  # (length of the pattern, payload) of the patterns ending in the node
+        for pattern, payload in patterns.items():
+            node = 0
+            for char in pattern:
+                if char not in self.transitions[node]:
+                    self.transitions.append({})
+                    self.failures.append(0)
+                    self.outputs.append([])
+                    self.transitions[node][char] = len(self.transitions) - 1
+                node = self.transitions[node][char]
+            self.outputs[node].append((len(pattern), payload))
+        queue = list(self.transitions[0].values())
+        for node in queue:  # breadth first, the failure of a node is known before its children's
+            for char, child in self.transitions[node].items():
+                failure = self.failures[node]
+                while failure and char not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                self.failures[child] = self.transitions[failure].get(char, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.failures[child]]
+                queue.append(child)
+
+    def findAll(self, text):
+        """
+        Yields (start index, payload) of every occurrence.
+        """
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self.transitions[node]:
+                node = self.failures[node]
+            node = self.transitions[node].get(char, 0)
+            for length, payload in self.outputs[node]:
+                yield i - length + 1, payload
+
+
+class SpokenMove:
+    def __init__(self, words):
+        """
+        A move as it was heard. The parts that weren't recognized are None, the rows are digits like in the notation.
+        """
+        self.words = words
+        self.castle = None  # "O-O" or "O-O-O"
+        self.figure = None
+        self.startCol = None
+        self.startRow = None
+        self.endCol = None
+        self.endRow = None
+        self.promotion = None
+        self.scores = {}  # part -> EXACT_SCORE or STEM_SCORE
+
+    def isComplete(self):
+        return self.castle is not None or None not in (self.figure, self.startCol, self.startRow, self.endCol,
+                                                       self.endRow)
+
+    def getScore(self):
+        """
+        How sure the recognition of the move is, from 0 (nothing recognized) to 1 (every word is in the dictionary).
+        """
+        if self.castle is not None:
+            return self.scores["castle"]
+        return sum(self.scores.get(part, 0) for part in ("figure", "startCol", "startRow", "endCol", "endRow")) / 5
+
+    def getNotation(self):
+        """
+        The notation string of reformatSpeech: "Unknown ", "(-)" and "[-]" stand for the parts not recognized.
+        """
+        if self.castle is not None:
+            return self.castle
+        res = self.figure if self.figure is not None else "Unknown "
+        res += (self.startCol or "(-)") + (self.startRow or "[-]") + "-" + (self.endCol or "(-)") + \
+            (self.endRow or "[-]")
+        if self.promotion is not None:
+            res += self.promotion
+        return res
+
+
 class NotationTranslator:
 
     def __init__(self):
@@ -6,166 +121,240 @@ class NotationTranslator:
         self.ruColDict = {"а": "a", "б": "b", "бы": "b", "бай": "b", "це": "c", "с": "c", "со": "c", "де": "d", "дай": "d",
                           "я": "e", "ей": "e", "е": "e", "эф": "f", "же": "g", "аш": "h", "аж": "h"}
         self.ruExceptionsList = {"едва": "e2", "опять": "a5", "фадин": "f1"}
+        # how the columns are pronounced, the automaton recognizes all of them
+        self.ruColNames = {"a": "а", "b": "бэ", "c": "це", "d": "дэ", "e": "е", "f": "эф", "g": "же", "h": "аш"}
+        self.ruCastlesList = {"O-O": "рокировка", "O-O-O": "длинная рокировка"}
+        self.ruCommandsList = ["стоп", "отмена", "сброс"]
+        self.ruFigureNames = {v: k for k, v in self.ruFigureDict.items()}
+        self.ruNumberNames = {str(v): k for k, v in self.ruNumberDict.items()}
+        # parts of the words recognized when the whole word isn't in a dictionary, checked in this order
+        self.ruFigureStems = [("коро", "K"), ("сло", "B"), ("салон", "B"), ("фе", "Q"), ("фи", "Q"), ("перси", "Q"),
+                              ("лад", "R"), ("кон", "N"), ("пеш", "p")]
+        self.ruColStems = [("д", "d"), ("ф", "f"), ("ж", "g"), ("б", "b"), ("ц", "c"), ("а", "a"), ("е", "e")]
+        self.automaton = self.compileAutomaton()
+        self.meanings = {}  # word -> what it can mean, see getMeaning
+        self.spellings = {}  # (kind, value) -> the words for it
+        for words, kind in ((self.ruFigureDict, FIGURE), (self.ruColDict, COL), (self.ruNumberDict, ROW)):
+            for word, value in words.items():
+                self.spellings.setdefault((kind, str(value)), []).append(word)
+        for col, word in self.ruColNames.items():
+            self.spellings[(COL, col)].append(word)
+        self.spellings[(CASTLE, "O-O")] = ["рокировка"]
+        self.spellings[(LONG, "O-O-O")] = ["длинная"]
+        self.wordCosts = {}  # (word, token) -> cost, see getWordCost
 
-    def reformatSpeech(self, speechString):
-        objectsList = []
+    def compileAutomaton(self):
+        """
+        The whole words are matched with the spaces around them, the stems anywhere in the word.
+        The payload is (kind, value, score, priority), a lower priority wins among the stems of a kind.
+        """
+        patterns = {}
+
+        def add(pattern, token):
+            patterns.setdefault(pattern, []).append(token)
+
+        for word, figure in self.ruFigureDict.items():
+            add(" " + word + " ", (FIGURE, figure, EXACT_SCORE, -1))
+        for word, col in list(self.ruColDict.items()) + [(word, col) for col, word in self.ruColNames.items()]:
+            if (COL, col, EXACT_SCORE, -1) not in patterns.get(" " + word + " ", []):
+                add(" " + word + " ", (COL, col, EXACT_SCORE, -1))
+        for word, row in self.ruNumberDict.items():
+            add(" " + word + " ", (ROW, str(row), EXACT_SCORE, -1))
+        for word, square in self.ruExceptionsList.items():
+            add(" " + word + " ", (SQUARE, square, EXACT_SCORE, -1))
+        for priority, (stem, figure) in enumerate(self.ruFigureStems):
+            add(stem, (FIGURE, figure, STEM_SCORE, priority))
+        for priority, (stem, col) in enumerate(self.ruColStems):
+            add(stem, (COL, col, STEM_SCORE, priority))
+        add("рок", (CASTLE, "O-O", EXACT_SCORE, -1))
+        add("длин", (LONG, "O-O-O", EXACT_SCORE, -1))
+        return PatternAutomaton(patterns)
+
+    def getMeaning(self, word):
+        """
+        Returns a dict kind -> (value, score) of what the word can mean. The automaton runs once per new word,
+        the meanings are kept.
+        """
+        meaning = self.meanings.get(word)
+        if meaning is not None:
+            return meaning
+        found = {}  # kind -> (priority, value, score)
+        for _, tokens in self.automaton.findAll(" " + word + " "):
+            for kind, value, score, priority in tokens:
+                if kind not in found or priority < found[kind][0]:
+                    found[kind] = (priority, value, score)
+        if ROW in found and COL in found and found[COL][0] != -1:
+            del found[COL]  # a number is never a column
+        meaning = {kind: (value, score) for kind, (_, value, score) in found.items()}
+        if len(self.meanings) >= MAX_CACHED_WORDS:
+            self.meanings.clear()
+        self.meanings[word] = meaning
+        return meaning
+
+    def translate(self, speechString):
+        """
+        Returns the SpokenMove heard in the text: a figure, the start and the end square, each of them a column
+        and a row or one word for both, and the promoting figure after a pawn move.
+        """
         if not isinstance(speechString, str):
             raise TypeError("Argument is not str.")
-        if "длин" in speechString and "рок" in speechString:
-            return "O-O-O"
-        if "рок" in speechString:
-            return "O-O"
-        inputString = speechString
-        if " " not in inputString:
-            print("Incorrect move.")
-            return "Unknown (-)[-]-(-)[-]"
-        while " " in inputString:
-            obj, inputString = inputString.split(" ", 1)
-            objectsList.append(obj)
-        objectsList.append(inputString)
-        res = ""
-        collidedValuesFirst = False
-        collidedValuesSecond = False
-        if len(objectsList) > 0:
-            res = self.recognizeFigure(objectsList[0], res)
-        if len(objectsList) > 1:
-            if objectsList[1] in self.ruExceptionsList:
-                res += self.ruExceptionsList[objectsList[1]]
-                collidedValuesFirst = True
-                res += "-"
-            else:
-                res = self.recognizeCol(objectsList[1], res)
-        if len(objectsList) > 2:
-            if not collidedValuesFirst:
-                res = self.recognizeRow(objectsList[2], res)
-                res += "-"
+        words = speechString.lower().split()
+        spokenMove = SpokenMove(words)
+        meanings = [self.getMeaning(word) for word in words]
+        if any(CASTLE in meaning for meaning in meanings):
+            spokenMove.castle = "O-O-O" if any(LONG in meaning for meaning in meanings) else "O-O"
+            spokenMove.scores["castle"] = EXACT_SCORE
+            return spokenMove
+        parts = ["figure", "startCol", "startRow", "endCol", "endRow", "promotion"]
+        state = 0
+        for meaning in meanings:
+            part = parts[state]
+            if part in ("figure", "promotion"):
+                kind = FIGURE
+            elif part in ("startCol", "endCol"):
+                kind = SQUARE if SQUARE in meaning else COL
             else:
-                if objectsList[2] in self.ruExceptionsList:
-                    res += self.ruExceptionsList[objectsList[1]]
-                    collidedValuesSecond = True
+                kind = ROW
+            if kind in meaning:
+                value, score = meaning[kind]
+                if kind == SQUARE:
+                    setattr(spokenMove, part, value[0])
+                    setattr(spokenMove, part.replace("Col", "Row"), value[1])
+                    spokenMove.scores[part.replace("Col", "Row")] = score
                 else:
-                    res = self.recognizeCol(objectsList[2], res)
-        if len(objectsList) > 3:
-            if objectsList[3] in self.ruExceptionsList:
-                res += self.ruExceptionsList[objectsList[3]]
-            else:
-                if collidedValuesFirst:
-                    res = self.recognizeRow(objectsList[3], res)
-                else:
-                    res = self.recognizeCol(objectsList[3], res)
-        if len(objectsList) > 4:
-            if (collidedValuesFirst and not collidedValuesSecond) or (collidedValuesSecond and "p" in res):
-                res = self.recognizeFigure(objectsList[4], res)
+                    setattr(spokenMove, part, value)
+                spokenMove.scores[part] = score
+            state += 2 if kind == SQUARE else 1
+            if state == 5 and spokenMove.figure != "p" or state == 6:
+                break
+        return spokenMove
+
+    def getMoveTokens(self, move):
+        """
+        The ways a valid move can be said as lists of (kind, value): with the start square and without it,
+        "конь эф три" for Ng1-f3.
+        """
+        if move.isCastleMove:
+            if move.endCol > move.startCol:
+                return [[(CASTLE, "O-O")]]
+            return [[(LONG, "O-O-O"), (CASTLE, "O-O")]]
+        start = move.getRankFile(move.startRow, move.startCol)
+        end = move.getRankFile(move.endRow, move.endCol)
+        figure = [(FIGURE, move.pieceMoved[1])]
+        endSquare = [(COL, end[0]), (ROW, end[1])]
+        promotion = [(FIGURE, move.piecePromoting)] if move.isPawnPromotion else []
+        return [figure + [(COL, start[0]), (ROW, start[1])] + endSquare + promotion, figure + endSquare + promotion]
+
+    def getHeardItems(self, words):
+        """
+        (word, meaning) of every word heard, a word for a whole square gives a column and a row without a word.
+        """
+        items = []
+        for word in words:
+            meaning = self.getMeaning(word)
+            if SQUARE in meaning:
+                (col, row), score = meaning[SQUARE]
+                items += [(None, {COL: (col, score)}), (None, {ROW: (row, score)})]
             else:
-                res = self.recognizeRow(objectsList[4], res)
-        if len(objectsList) > 5:
-            if "p" in res:
-                res = self.recognizeFigure(objectsList[5], res)
-        return res
+                items.append((word, meaning))
+        return items
+
+    def getWordCost(self, item, token):
+        """
+        0 if the word means the token and MISMATCH_COST if it surely means something else. A word recognized only
+        by a stem or not at all costs up to 1 by the edit distance to the spellings of the token.
+        """
+        word, meaning = item
+        kind, value = token
+        cost = 1.0
+        if kind in meaning:
+            meantValue, score = meaning[kind]
+            if score == EXACT_SCORE:
+                return 0.0 if meantValue == value else MISMATCH_COST
+            if meantValue == value:
+                cost = (1 - score) / 2
+        if word is None or token not in self.spellings:
+            return cost
+        spellingCost = self.wordCosts.get((word, token))
+        if spellingCost is None:
+            spellingCost = min(editDistance(word, spelling) / max(len(word), len(spelling))
+                               for spelling in self.spellings[token])
+            if len(self.wordCosts) >= MAX_CACHED_WORDS:
+                self.wordCosts.clear()
+            self.wordCosts[(word, token)] = spellingCost
+        return min(cost, spellingCost)
+
+    def getAlignmentCost(self, items, tokens):
+        """
+        Edit distance of the words heard to the tokens of a move, a missing or an extra word costs 1.
+        """
+        previous = [float(j) for j in range(len(tokens) + 1)]
+        for i, item in enumerate(items, 1):
+            current = [float(i)]
+            for j, token in enumerate(tokens, 1):
+                current.append(min(previous[j] + 1, current[j - 1] + 1,
+                                   previous[j - 1] + self.getWordCost(item, token)))
+            previous = current
+        return previous[-1]
 
-    def deprecatedReformatSpeech(self, speechString):
+    def resolveMove(self, speechString, validMoves):
+        """
+        Compares the text with every valid move and returns (the move it names or None, [(cost, move)] from the
+        cheapest). A move is resolved when it costs at most MAX_RESOLVE_COST and no other move is close to it,
+        so a misheard word or a part left out, like the start square, is forgiven if only one move fits.
+        """
         if not isinstance(speechString, str):
             raise TypeError("Argument is not str.")
-        if "длин" in speechString and "рок" in speechString:
-            return "O-O-O"
-        if "рок" in speechString:
-            return "O-O"
-        speechString.lower()
-        result = ""
-        if " " in speechString:
-            figure, move = speechString.split(" ", 1)
-        else:
-            print("Incorrect move recognition.")
-            return "Unknown (-)[-]-(-)[-]"
-        figure = str(figure)
-        move = str(move)
-        result = self.recognizeFigure(figure, result)
-        if " " in move:
-            moveStartColContender, otherPartOfMove = move.split(" ", 1)
-        else:
-            print("Incorrect move recognition.")
-            return result + "(-)[-]-(-)[-]"
-        moveStartColContender = str(moveStartColContender)
-        otherPartOfMove = str(otherPartOfMove)
-
-        result = self.recognizeCol(moveStartColContender, result)
-        if " " in otherPartOfMove:
-            moveStartNumberContender, otherPartOfMove = otherPartOfMove.split(" ", 1)
-        else:
-            print("Incorrect move recognition.")
-            return result + "[-]-(-)[-]"
-        result = self.recognizeRow(moveStartNumberContender, result)
-        result += "-"
-        if " " in otherPartOfMove:
-            moveEndColContender, otherPartOfMove = otherPartOfMove.split(" ", 1)
-            result = self.recognizeCol(moveEndColContender, result)
-            if " " in otherPartOfMove:
-                moveEndRowContender, otherPartOfMove = otherPartOfMove.split(" ", 1)
-                result = self.recognizeRow(moveEndRowContender, result)
-
-            return result
-        elif otherPartOfMove in self.ruExceptionsList:
-            result += self.ruExceptionsList[otherPartOfMove]
-        else:
-            print("Neither endCol, nor endRow is not recognized")
-            result += "(-)[-]"
-            print("Returned:" + result)
-        return result
-
-    def recognizeRow(self, moveStartNumberContender, result):
-        if moveStartNumberContender in self.ruNumberDict:
-            result += str(self.ruNumberDict[moveStartNumberContender])
-        else:
-            print("Row number is not recognized")
-            result += "[-]"
-        return result
-
-    def recognizeCol(self, moveColContender, result):
-        if moveColContender in self.ruExceptionsList:
-            result += self.ruExceptionsList[moveColContender]
-        else:
-            if moveColContender in self.ruColDict:
-                result += self.ruColDict[moveColContender]
-            elif moveColContender not in self.ruNumberDict:
-                if "д" in moveColContender:
-                    result += "d"
-                elif "ф" in moveColContender:
-                    result += "f"
-                elif "ж" in moveColContender:
-                    result += "g"
-                elif "б" in moveColContender:
-                    result += "b"
-                elif "ц" in moveColContender:
-                    result += "c"
-                elif "а" in moveColContender:
-                    result += "a"
-                elif "е" in moveColContender:
-                    result += "e"
-                else:
-                    print("Column is not recognized")
-                    result += "(-)"
-            else:
-                print("Column is not recognized")
-                result += "(-)"
-        return result
-
-    def recognizeFigure(self, figure, result):
-        if figure in self.ruFigureDict:
-            result += self.ruFigureDict[figure]
-        else:
-            if "коро" in figure:
-                result += "K"
-            elif "сло" in figure or "салон" in figure:
-                result += "B"
-            elif "фе" in figure or "фи" in figure or "перси" in figure:
-                result += "Q"
-            elif "лад" in figure:
-                result += "R"
-            elif "кон" in figure:
-                result += "N"
-            elif "пеш" in figure:
-                result += "p"
-            else:
-                print("Incorrect figure recognition.")
-                result += "Unknown "
-        return result
+        items = self.getHeardItems(speechString.lower().split())
+        candidates = sorted(((min(self.getAlignmentCost(items, tokens) for tokens in self.getMoveTokens(move)), i)
+                             for i, move in enumerate(validMoves)))
+        candidates = [(cost, validMoves[i]) for cost, i in candidates]
+        if not candidates or candidates[0][0] > MAX_RESOLVE_COST:
+            return None, candidates
+        if len(candidates) > 1 and candidates[1][0] - candidates[0][0] < MIN_RESOLVE_MARGIN:
+            return None, candidates
+        return candidates[0][1], candidates
+
+    def moveNotation(self, move):
+        """
+        The notation of a ChessEngine.Move the way reformatSpeech gives it, "Ng1-f3" or "pe7-e8Q".
+        """
+        if move.isCastleMove:
+            return "O-O" if move.endCol > move.startCol else "O-O-O"
+        return move.pieceMoved[1] + move.getRankFile(move.startRow, move.startCol) + "-" + \
+            move.getRankFile(move.endRow, move.endCol) + (move.piecePromoting if move.isPawnPromotion else "")
+
+    def movePhrase(self, move):
+        """
+        The words of a ChessEngine.Move the way reformatSpeech expects them: figure, start and end square and
+        the promoting figure.
+        """
+        if move.isCastleMove:
+            return self.ruCastlesList["O-O" if move.endCol > move.startCol else "O-O-O"]
+        start = move.getRankFile(move.startRow, move.startCol)
+        end = move.getRankFile(move.endRow, move.endCol)
+        words = [self.ruFigureNames[move.pieceMoved[1]], self.ruColNames[start[0]], self.ruNumberNames[start[1]],
+                 self.ruColNames[end[0]], self.ruNumberNames[end[1]]]
+        if move.isPawnPromotion:
+            words.append(self.ruFigureNames[move.piecePromoting])
+        return " ".join(words)
+
+    def buildGrammar(self, validMoves):
+        """
+        Phrase list for a grammar-constrained recognizer: every valid move with and without its start square
+        (see resolveMove), the voice commands and "[unk]" for everything else.
+        """
+        phrases = set()
+        for move in validMoves:
+            phrase = self.movePhrase(move)
+            phrases.add(phrase)
+            if not move.isCastleMove:
+                words = phrase.split(" ")
+                phrases.add(" ".join(words[:1] + words[3:]))
+        return sorted(phrases) + self.ruCommandsList + ["[unk]"]
+
+    def reformatSpeech(self, speechString):
+        """
+        The notation string of translate, see SpokenMove.getNotation.
+        """
+        return self.translate(speechString).getNotation()